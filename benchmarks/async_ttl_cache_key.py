@@ -0,0 +1,49 @@
+"""Per-call overhead of `async_ttl_cache` cache hits, by key function.
+
+Run with `python -m benchmarks.async_ttl_cache_key` from the repository root.
+"""
+
+import asyncio
+import time
+from typing import Callable, Dict, Hashable, Tuple
+
+from cloud_utils.cache import async_ttl_cache
+
+_CALLS = 100_000
+
+
+def _repr_key(args: Tuple, kwargs: Dict) -> Hashable:
+    # The key used before `key=` was introduced.
+    return str((args, kwargs))
+
+
+async def _identity(*args, **kwargs):
+    return args
+
+
+async def _time_hits(key: Callable[[Tuple, Dict], Hashable], args: Tuple) -> float:
+    cached = async_ttl_cache.async_ttl_cache(ttl=600, maxsize=10, key=key)(_identity)
+    await cached(*args)
+    start = time.perf_counter()
+    for _ in range(_CALLS):
+        await cached(*args)
+    return (time.perf_counter() - start) / _CALLS * 1e6
+
+
+async def _main():
+    small_args = ("user-id", 42)
+    large_args = (tuple(range(1_000)), "label")
+    json_args = ({"ids": list(range(1_000)), "label": "x"},)
+    for label, key, args in (
+        ("repr, small args", _repr_key, small_args),
+        ("tuple, small args", async_ttl_cache.tuple_key, small_args),
+        ("repr, large args", _repr_key, large_args),
+        ("tuple, large args", async_ttl_cache.tuple_key, large_args),
+        ("repr, dict args", _repr_key, json_args),
+        ("stable hash, dict args", async_ttl_cache.stable_hash_key, json_args),
+    ):
+        print(f"{label:<24} {await _time_hits(key, args):8.2f} us/call")  # noqa: T201
+
+
+if __name__ == "__main__":
+    asyncio.run(_main())
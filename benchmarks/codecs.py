@@ -0,0 +1,68 @@
+"""Encode/decode throughput and stored bytes of the redis store codecs.
+
+Run with `python -m benchmarks.codecs` from the repository root.
+Codecs whose optional dependency is not installed are skipped.
+"""
+
+import json
+import time
+
+from cloud_utils.cache.stores import codecs
+
+_ROUNDS = 2_000
+
+_PAYLOADS = {
+    "small": {"id": "a1b2c3", "score": 0.93, "label": "order_food"},
+    "nlu result": {
+        "text": "I would like two large pizzas with extra cheese please",
+        "intents": [
+            {"name": f"intent_{i}", "score": 1 / (i + 1), "slots": {"size": "large"}}
+            for i in range(40)
+        ],
+        "entities": [
+            {"type": "food", "value": "pizza", "start": i, "end": i + 5}
+            for i in range(100)
+        ],
+    },
+    "embedding": {"vector": [i / 7 for i in range(2_048)], "model": "encoder-v3"},
+}
+
+
+def _measure(label: str, payload_name: str, serializer: str, compression):
+    try:
+        encoder, decoder = codecs.make_codec(serializer, compression, 256)
+    except ImportError:
+        print(f"{label:<16} {payload_name:<12} not installed")  # noqa: T201
+        return
+    payload = _PAYLOADS[payload_name]
+    start = time.perf_counter()
+    for _ in range(_ROUNDS):
+        encoded = encoder(payload)
+    encode_seconds = time.perf_counter() - start
+    start = time.perf_counter()
+    for _ in range(_ROUNDS):
+        decoder(encoded)
+    decode_seconds = time.perf_counter() - start
+    size_mb = len(encoded) * _ROUNDS / 2**20
+    print(  # noqa: T201
+        f"{label:<16} {payload_name:<12} {len(encoded):8,} bytes, encode {size_mb / encode_seconds:8.1f} MB/s, decode {size_mb / decode_seconds:8.1f} MB/s",
+    )
+
+
+def _main():
+    for payload_name, payload in _PAYLOADS.items():
+        print(  # noqa: T201
+            f"{'json.dumps':<16} {payload_name:<12} {len(json.dumps(payload)):8,} bytes (baseline)",
+        )
+        for serializer in ("json", "pickle", "msgpack"):
+            for compression in (None, "zlib", "zstd", "lz4"):
+                _measure(
+                    f"{serializer}+{compression or 'none'}",
+                    payload_name,
+                    serializer,
+                    compression,
+                )
+
+
+if __name__ == "__main__":
+    _main()
@@ -0,0 +1,61 @@
+"""Load latency (read and decode) and disk bytes of the file_store local cache encodings, against plain json.
+
+Run with `python -m benchmarks.file_store` from the repository root.
+Encodings whose optional dependency is not installed are skipped.
+"""
+
+import pathlib
+import tempfile
+import time
+
+from cloud_utils.cache import file_store
+
+_ROUNDS = 5
+
+# A large build artifact, shaped like an nlu model's lookup tables.
+_ARTIFACT = {
+    "vocabulary": {f"token_{i}": i for i in range(200_000)},
+    "embeddings": [[(i * j) % 97 / 97 for j in range(64)] for i in range(5_000)],
+    "intents": [
+        {
+            "name": f"intent_{i}",
+            "examples": [f"example {j} of intent {i}" for j in range(50)],
+        }
+        for i in range(500)
+    ],
+}
+
+
+def _measure(cache_path: pathlib.Path, label: str, serializer, compression):
+    try:
+        encoder, decoder = file_store.local_codec(serializer, compression)
+        encoded = encoder(_ARTIFACT)
+    except ImportError:
+        print(f"{label:<16} not installed")  # noqa: T201
+        return
+    path = cache_path / f"{label.replace('+', '_')}.json"
+    path.write_bytes(encoded)
+    start = time.perf_counter()
+    for _ in range(_ROUNDS):
+        decoder(path.read_bytes())
+    load_seconds = (time.perf_counter() - start) / _ROUNDS
+    print(  # noqa: T201
+        f"{label:<16} {path.stat().st_size / 2**20:8.1f} MB on disk, load {load_seconds * 1000:8.1f} ms",
+    )
+
+
+def _main():
+    with tempfile.TemporaryDirectory() as cache_path:
+        _measure(pathlib.Path(cache_path), "plain json", None, None)
+        for serializer in ("json", "msgpack"):
+            for compression in (None, "zlib", "zstd", "lz4"):
+                _measure(
+                    pathlib.Path(cache_path),
+                    f"{serializer}+{compression or 'none'}",
+                    serializer,
+                    compression,
+                )
+
+
+if __name__ == "__main__":
+    _main()
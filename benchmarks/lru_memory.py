@@ -0,0 +1,67 @@
+"""Compares the lru_memory store to its previous implementation at 1M entries.
+
+Run with `python -m benchmarks.lru_memory` from the repository root.
+"""
+
+import collections
+import sys
+import time
+import tracemalloc
+
+from cloud_utils.cache import utils
+from cloud_utils.cache.stores import lru_memory
+
+_ENTRIES = 1_000_000
+
+
+def _make_previous_store(max_size: int, name: str):
+    # The implementation before byte budgets and ttl were added.
+    store = collections.OrderedDict()
+
+    def set_item(key: str, value):
+        cache_key = utils.cache_key_name(name, key)
+        store[cache_key] = value
+
+        if max_size and len(store) > max_size and max_size != 0:
+            store.popitem(last=False)
+
+    def get_item(key: str):
+        cache_key = utils.cache_key_name(name, key)
+        item = store[cache_key]
+        store[cache_key] = item
+        return item
+
+    return get_item, set_item
+
+
+def _measure(label: str, make_store):
+    keys = [str(x) for x in range(_ENTRIES)]
+    tracemalloc.start()
+    get_item, set_item = make_store()
+    start = time.perf_counter()
+    for key in keys:
+        set_item(key, key)
+    set_seconds = time.perf_counter() - start
+    size, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    start = time.perf_counter()
+    for key in keys:
+        get_item(key)
+    get_seconds = time.perf_counter() - start
+    print(  # noqa: T201
+        f"{label:<28} set {set_seconds / _ENTRIES * 1e9:6.0f} ns, get {get_seconds / _ENTRIES * 1e9:6.0f} ns, {size / 2**20:6.1f} MiB",
+    )
+
+
+def _main():
+    _measure("previous", lambda: _make_previous_store(_ENTRIES, "bench"))
+    _measure("count bound", lambda: lru_memory.make_store(_ENTRIES, "bench"))
+    _measure(
+        "byte budget (getsizeof)",
+        lambda: lru_memory.make_store(0, "bench", max_bytes=2**40, sizer=sys.getsizeof),
+    )
+    _measure("ttl", lambda: lru_memory.make_store(_ENTRIES, "bench", ttl=600))
+
+
+if __name__ == "__main__":
+    _main()
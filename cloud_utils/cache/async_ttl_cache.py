@@ -1,20 +1,79 @@
+import asyncio
 import functools
+import logging
+from typing import Callable, Dict, Hashable, Tuple
 
 import cachetools
+import gamla
 
+_KWARGS_MARK = (object(),)
 
-def async_ttl_cache(ttl: int, maxsize: int):
+
+def tuple_key(args: Tuple, kwargs: Dict) -> Hashable:
+    """A flat tuple key, in the spirit of `functools._make_key`. Falls back to a repr key for unhashable arguments."""
+    key = args + _KWARGS_MARK + tuple(sorted(kwargs.items())) if kwargs else args
+    try:
+        hash(key)
+    except TypeError:
+        return str((args, kwargs))
+    return key
+
+
+def stable_hash_key(args: Tuple, kwargs: Dict) -> Hashable:
+    """A content hash key, for json serializable arguments which are not hashable (e.g. dicts and lists)."""
+    return gamla.compute_stable_json_hash([args, kwargs])
+
+
+def async_ttl_cache(
+    ttl: int,
+    maxsize: int,
+    serve_stale: bool = False,
+    key: Callable[[Tuple, Dict], Hashable] = tuple_key,
+):
+    """Caches the results of a coroutine function for `ttl` seconds.
+
+    The cache key is computed by `key(args, kwargs)`.
+    Concurrent calls that miss the same key share a single call to the function.
+    Errors are propagated to all waiting callers and are not cached.
+    With `serve_stale`, an expired value is returned immediately while it is refreshed in the background.
+    """
     cache: cachetools.TTLCache = cachetools.TTLCache(ttl=ttl, maxsize=maxsize)
+    stale_cache: cachetools.LRUCache = cachetools.LRUCache(maxsize=maxsize)
+    in_flight: Dict[Hashable, asyncio.Future] = {}
+
+    def on_done(cache_key: Hashable, future: asyncio.Future):
+        del in_flight[cache_key]
+        if future.cancelled():
+            return
+        if future.exception() is not None:
+            logging.debug(f"async_ttl_cache: call for {cache_key} failed, not caching.")
+            return
+        cache[cache_key] = future.result()
+        if serve_stale:
+            stale_cache[cache_key] = cache[cache_key]
 
     def decorator(fn):
+        def load(cache_key: Hashable, args, kwargs) -> asyncio.Future:
+            if cache_key not in in_flight:
+                in_flight[cache_key] = asyncio.ensure_future(fn(*args, **kwargs))
+                in_flight[cache_key].add_done_callback(
+                    functools.partial(on_done, cache_key),
+                )
+            return in_flight[cache_key]
+
         @functools.wraps(fn)
         async def memoize(*args, **kwargs):
-            key = str((args, kwargs))
+            cache_key = key(args, kwargs)
             try:
-                cache[key] = cache.pop(key)
+                cache[cache_key] = cache.pop(cache_key)
+                return cache[cache_key]
             except KeyError:
-                cache[key] = await fn(*args, **kwargs)
-            return cache[key]
+                pass
+            if serve_stale and cache_key in stale_cache:
+                load(cache_key, args, kwargs)
+                return stale_cache[cache_key]
+            # Shield so a cancelled caller does not cancel the call shared with other callers.
+            return await asyncio.shield(load(cache_key, args, kwargs))
 
         return memoize
 
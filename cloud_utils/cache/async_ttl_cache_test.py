@@ -0,0 +1,91 @@
+import asyncio
+
+import pytest
+
+from cloud_utils.cache import async_ttl_cache
+
+
+async def test_concurrent_misses_share_one_call():
+    calls = []
+
+    @async_ttl_cache.async_ttl_cache(ttl=60, maxsize=10)
+    async def f(x):
+        calls.append(x)
+        await asyncio.sleep(0.01)
+        return x * 2
+
+    assert await asyncio.gather(*(f(1) for _ in range(20))) == [2] * 20
+    assert await f(1) == 2
+    assert calls == [1]
+
+
+async def test_errors_propagate_to_all_waiters_and_are_not_cached():
+    calls = []
+
+    @async_ttl_cache.async_ttl_cache(ttl=60, maxsize=10)
+    async def f(x):
+        calls.append(x)
+        await asyncio.sleep(0.01)
+        raise ValueError
+
+    results = await asyncio.gather(*(f(1) for _ in range(5)), return_exceptions=True)
+    assert all(isinstance(result, ValueError) for result in results)
+    with pytest.raises(ValueError):
+        await f(1)
+    assert calls == [1, 1]
+
+
+async def test_serve_stale_refreshes_in_background():
+    values = iter(range(10))
+
+    @async_ttl_cache.async_ttl_cache(ttl=0.05, maxsize=10, serve_stale=True)
+    async def f():
+        return next(values)
+
+    assert await f() == 0
+    await asyncio.sleep(0.1)
+    assert await f() == 0
+    await asyncio.sleep(0.01)
+    assert await f() == 1
+
+
+def test_tuple_key_distinguishes_args_from_kwargs():
+    assert async_ttl_cache.tuple_key((1, 2), {}) != async_ttl_cache.tuple_key(
+        (1,),
+        {"b": 2},
+    )
+    assert async_ttl_cache.tuple_key((), {"a": 1, "b": 2}) == async_ttl_cache.tuple_key(
+        (),
+        {"b": 2, "a": 1},
+    )
+
+
+async def test_stable_hash_key_supports_unhashable_arguments():
+    calls = []
+
+    @async_ttl_cache.async_ttl_cache(
+        ttl=60,
+        maxsize=10,
+        key=async_ttl_cache.stable_hash_key,
+    )
+    async def f(d):
+        calls.append(d)
+        return len(d)
+
+    assert await f({"a": [1], "b": 2}) == 2
+    assert await f({"b": 2, "a": [1]}) == 2
+    assert len(calls) == 1
+
+
+async def test_tuple_key_supports_unhashable_arguments():
+    calls = []
+
+    @async_ttl_cache.async_ttl_cache(ttl=60, maxsize=10)
+    async def f(d, items=()):
+        calls.append(d)
+        return len(d) + len(items)
+
+    assert await f({"a": [1]}, items=[1]) == 2
+    assert await f({"a": [1]}, items=[1]) == 2
+    assert await f({"a": [2]}) == 1
+    assert len(calls) == 2
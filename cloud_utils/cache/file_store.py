@@ -1,14 +1,27 @@
 import json
 import logging
+import os
 import pathlib
-from typing import Any, Dict
+import secrets
+from typing import Any, Dict, Optional
 
 import gamla
 
 from cloud_utils import storage
+from cloud_utils.cache.stores import codecs
 from cloud_utils.storage import utils
 
-_LOCAL_CACHE_PATH: pathlib.Path = pathlib.Path.home().joinpath(".nlu_cache")
+# Set `NLU_CACHE_PATH` to share the local cache between users or containers, writes are atomic so processes can share it.
+_LOCAL_CACHE_PATH: pathlib.Path = pathlib.Path(
+    os.getenv("NLU_CACHE_PATH", pathlib.Path.home().joinpath(".nlu_cache")),
+)
+# Least recently used items are evicted when the local cache exceeds this many bytes (0 for unbounded).
+_LOCAL_CACHE_MAX_BYTES = int(os.getenv("NLU_CACHE_MAX_BYTES", "0"))
+# Set either to write local items with `codecs` (e.g. `NLU_CACHE_COMPRESSION=zstd`) instead of plain json, see `local_codec`.
+_LOCAL_CACHE_SERIALIZER = os.getenv("NLU_CACHE_SERIALIZER")
+_LOCAL_CACHE_COMPRESSION = os.getenv("NLU_CACHE_COMPRESSION")
+# The local cache may be shared, so its items must never be unpickled.
+_LOCAL_SERIALIZERS = ("json", "msgpack")
 
 
 def open_file(mode: str):
@@ -40,14 +53,83 @@ def local_path_for_hash(object_hash: str) -> pathlib.Path:
     return local_path
 
 
+def local_codec(
+    serializer: Optional[str] = None,
+    compression: Optional[str] = None,
+) -> codecs.Codec:
+    """Returns `(encoder, decoder)` of local cache items, by default as set by `NLU_CACHE_SERIALIZER` and `NLU_CACHE_COMPRESSION`.
+
+    Without either, items are plain json. Otherwise they are encoded with `codecs`, as the json round trip of the object,
+    so local hits return the same types as loads from the bucket. Only `json` and `msgpack` are allowed.
+    The decoder reads plain json items (e.g. written before the encoding was set), and items of the configured serializer.
+    """
+    serializer = serializer or _LOCAL_CACHE_SERIALIZER
+    compression = compression or _LOCAL_CACHE_COMPRESSION
+    if serializer not in (None, *_LOCAL_SERIALIZERS):
+        raise ValueError(f"Local cache serializer must be one of {_LOCAL_SERIALIZERS}.")
+    encoder, decoder = codecs.make_codec(
+        serializer or "json",
+        compression,
+        legacy_decoder=json.loads,
+        accept=["json"],
+    )
+    if serializer is None and compression is None:
+        return gamla.compose_left(gamla.to_json, str.encode), decoder
+    return gamla.compose_left(gamla.to_json, json.loads, encoder), decoder
+
+
+def _touch(path: pathlib.Path) -> pathlib.Path:
+    # Modification times track use for eviction, access times are unreliable (e.g. `noatime` mounts).
+    try:
+        os.utime(path)
+    except FileNotFoundError:
+        raise
+    except OSError:  # E.g. a read only shared cache, which other processes manage.
+        pass
+    return path
+
+
+def _evict_local():
+    items = []
+    for path in _LOCAL_CACHE_PATH.glob(utils.hash_to_filename("*")):
+        try:
+            stat = path.stat()
+        except FileNotFoundError:  # Evicted by another process.
+            continue
+        items.append((stat.st_mtime, stat.st_size, path))
+    total_bytes = sum(size for _, size, _ in items)
+    for _, size, path in sorted(items):
+        if total_bytes <= _LOCAL_CACHE_MAX_BYTES:
+            break
+        path.unlink(missing_ok=True)
+        total_bytes -= size
+        logging.info(f"Evicted {path.name} from local cache.")
+
+
+def _discard(path: pathlib.Path):
+    try:
+        path.unlink(missing_ok=True)
+    except OSError:  # Not ours to remove, loads keep falling back to the bucket.
+        pass
+
+
 @gamla.curry
 def _save_local(object_hash: str, obj: Any) -> Any:
     local_path = local_path_for_hash(object_hash)
     if local_path.exists():
         return
-    with local_path.open("w") as f:
-        f.write(gamla.to_json(obj))
+    # Write a temporary file and rename it, so concurrent readers never see a partial file.
+    # Each writer has its own temporary file, concurrent writers of the same item write identical content.
+    temp_path = local_path.with_name(f"{local_path.name}.{secrets.token_hex(8)}.tmp")
+    try:
+        with temp_path.open("xb") as f:
+            f.write(local_codec()[0](obj))
+        os.replace(temp_path, local_path)
+    finally:
+        temp_path.unlink(missing_ok=True)
     logging.info(f"Saved {object_hash} to local cache.")
+    if _LOCAL_CACHE_MAX_BYTES:
+        _evict_local()
 
 
 @gamla.curry
@@ -57,21 +139,27 @@ def load_by_hash(should_save_local: bool, bucket_name: str, object_hash: str) ->
         return gamla.pipe(
             object_hash,
             local_path_for_hash,
-            lambda x: x.open("r"),
-            json.load,
+            _touch,
+            pathlib.Path.read_bytes,
+            local_codec()[1],
             gamla.log_text(f"Loaded {object_hash} from local cache."),
         )
     except FileNotFoundError:
-        return gamla.pipe(
-            object_hash,
-            gamla.log_text(f"Loading {object_hash} from bucket..."),
-            _load_item(bucket_name),
-            (
-                gamla.side_effect(_save_local(object_hash))
-                if should_save_local
-                else gamla.identity
-            ),
-        )
+        pass
+    # Not readable with the configured encoding (e.g. malformed, or pickled by another writer of a shared cache).
+    except ValueError:
+        logging.warning(f"Discarding unreadable {object_hash} from local cache.")
+        _discard(local_path_for_hash(object_hash))
+    return gamla.pipe(
+        object_hash,
+        gamla.log_text(f"Loading {object_hash} from bucket..."),
+        _load_item(bucket_name),
+        (
+            gamla.side_effect(_save_local(object_hash))
+            if should_save_local
+            else gamla.identity
+        ),
+    )
 
 
 def load_file_from_bucket(bucket_name: str, file_name: str):
@@ -0,0 +1,121 @@
+import concurrent.futures
+import os
+import pickle
+import threading
+
+import pytest
+
+from cloud_utils import storage
+from cloud_utils.cache import file_store
+
+
+@pytest.fixture
+def local_cache(tmp_path, monkeypatch):
+    monkeypatch.setattr(file_store, "_LOCAL_CACHE_PATH", tmp_path)
+    monkeypatch.setattr(storage, "upload_blob", lambda *_: None, raising=False)
+    return tmp_path
+
+
+def _save(obj) -> str:
+    return file_store.save_to_bucket_return_hash(True, "bucket")(obj)
+
+
+def test_load_by_hash_reads_local_cache(local_cache):
+    object_hash = _save({"a": 1})
+
+    assert file_store.load_by_hash(True, "bucket", object_hash) == {"a": 1}
+    assert [path.name for path in local_cache.rglob("*") if path.is_file()] == [
+        f"{object_hash}.json",
+    ]
+
+
+def test_local_cache_evicts_least_recently_used(local_cache, monkeypatch):
+    monkeypatch.setattr(file_store, "_LOCAL_CACHE_MAX_BYTES", 30)
+    first, second = _save({"value": "1"}), _save({"value": "2"})
+    os.utime(file_store.local_path_for_hash(first), (0, 0))
+    os.utime(file_store.local_path_for_hash(second), (1, 1))
+    # Loading touches it, so the second is evicted.
+    file_store.load_by_hash(True, "bucket", first)
+
+    third = _save({"value": "3"})
+
+    assert file_store.local_path_for_hash(first).exists()
+    assert not file_store.local_path_for_hash(second).exists()
+    assert file_store.local_path_for_hash(third).exists()
+
+
+def test_load_by_hash_reads_read_only_local_cache(local_cache, monkeypatch):
+    object_hash = _save({"a": 1})
+
+    def read_only_utime(*_):
+        raise PermissionError
+
+    monkeypatch.setattr(os, "utime", read_only_utime)
+
+    assert file_store.load_by_hash(True, "bucket", object_hash) == {"a": 1}
+
+
+def test_local_cache_encoding_reads_plain_json_items(local_cache, monkeypatch):
+    plain = _save({"a": 1})
+    monkeypatch.setattr(file_store, "_LOCAL_CACHE_COMPRESSION", "zlib")
+    compressed = _save({"b": [2] * 1_000})
+
+    assert file_store.local_path_for_hash(compressed).read_bytes()[0] == 0xCC
+    assert file_store.load_by_hash(True, "bucket", plain) == {"a": 1}
+    assert file_store.load_by_hash(True, "bucket", compressed) == {"b": [2] * 1_000}
+
+
+def test_local_cache_does_not_unpickle_items(local_cache, monkeypatch):
+    monkeypatch.setattr(
+        storage,
+        "download_blob_as_string",
+        lambda bucket_name: lambda blob_name: '{"from": "bucket"}',
+        raising=False,
+    )
+    file_store.local_path_for_hash("planted").write_bytes(
+        b"\xcc\x02\x00" + pickle.dumps({"from": "pickle"}),
+    )
+
+    assert file_store.load_by_hash(False, "bucket", "planted") == {"from": "bucket"}
+
+
+def test_local_codec_rejects_pickle():
+    with pytest.raises(ValueError):
+        file_store.local_codec("pickle")
+
+
+def test_concurrent_saves_of_one_item(local_cache, monkeypatch):
+    replace = os.replace
+    all_written = threading.Barrier(8)
+
+    def replace_after_all_written(*args):
+        all_written.wait(timeout=5)
+        replace(*args)
+
+    monkeypatch.setattr(os, "replace", replace_after_all_written)
+    with concurrent.futures.ThreadPoolExecutor(8) as executor:
+        hashes = set(executor.map(lambda _: _save({"a": 1}), range(8)))
+
+    assert [path.name for path in local_cache.rglob("*") if path.is_file()] == [
+        f"{hashes.pop()}.json",
+    ]
+
+
+def test_unreadable_local_item_is_replaced(local_cache, monkeypatch):
+    downloads = []
+
+    def download(bucket_name):
+        def download_blob(blob_name):
+            downloads.append(blob_name)
+            return '{"from": "bucket"}'
+
+        return download_blob
+
+    monkeypatch.setattr(storage, "download_blob_as_string", download, raising=False)
+    file_store.local_path_for_hash("truncated").write_bytes(b"{truncated")
+
+    for _ in range(3):
+        assert file_store.load_by_hash(True, "bucket", "truncated") == {
+            "from": "bucket",
+        }
+    assert len(downloads) == 1
@@ -0,0 +1,107 @@
+import inspect
+import logging
+import time
+from typing import Callable, Optional
+
+import redis
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+_ERRORS = (redis.ConnectionError, redis.TimeoutError)
+
+
+class CircuitOpenError(redis.ConnectionError):
+    pass
+
+
+def make_circuit_breaker(
+    name: str,
+    failure_threshold: int = 5,
+    reset_timeout: float = 30,
+    on_state_change: Optional[Callable[[str, str, str], None]] = None,
+) -> Callable[[Callable], Callable]:
+    """Returns `guard(f)`, which wraps redis calls (sync or async) with a circuit breaker.
+
+    After `failure_threshold` consecutive connection or timeout errors the circuit opens, and guarded calls raise
+    `CircuitOpenError` immediately. After `reset_timeout` seconds a single probe call is let through (half open),
+    closing the circuit if it succeeds and reopening it if it fails.
+    `on_state_change(name, old_state, new_state)` is called on every transition, e.g. to send a metric.
+    """
+    state = CLOSED
+    failures = 0
+    opened_at = 0.0
+    probing = False
+
+    def transition(new_state: str):
+        nonlocal state
+        old_state, state = state, new_state
+        logging.info(
+            f"redis: circuit for {name} changed from {old_state} to {new_state}",
+        )
+        if on_state_change is not None:
+            on_state_change(name, old_state, new_state)
+
+    def allow() -> bool:
+        nonlocal probing
+        if state == OPEN and time.monotonic() - opened_at >= reset_timeout:
+            transition(HALF_OPEN)
+        if state == HALF_OPEN:
+            if probing:
+                return False
+            probing = True
+            return True
+        return state == CLOSED
+
+    def record_success():
+        nonlocal failures, probing
+        failures = 0
+        probing = False
+        if state != CLOSED:
+            transition(CLOSED)
+
+    def record_failure():
+        nonlocal failures, probing, opened_at
+        failures += 1
+        probing = False
+        if state == HALF_OPEN or (state == CLOSED and failures >= failure_threshold):
+            opened_at = time.monotonic()
+            transition(OPEN)
+
+    async def guard_awaitable(awaitable, probe: bool):
+        try:
+            result = await awaitable
+        except _ERRORS:
+            record_failure()
+            raise
+        # Any other failure of the probe (e.g. cancelled by a timeout) also fails it, so another probe is let through later.
+        except BaseException:
+            if probe:
+                record_failure()
+            raise
+        record_success()
+        return result
+
+    def guard(f: Callable) -> Callable:
+        def guarded(*args, **kwargs):
+            if not allow():
+                raise CircuitOpenError(f"circuit for {name} is {state}")
+            probe = state == HALF_OPEN
+            try:
+                result = f(*args, **kwargs)
+            except _ERRORS:
+                record_failure()
+                raise
+            except BaseException:
+                if probe:
+                    record_failure()
+                raise
+            if inspect.isawaitable(result):
+                return guard_awaitable(result, probe)
+            record_success()
+            return result
+
+        return guarded
+
+    return guard
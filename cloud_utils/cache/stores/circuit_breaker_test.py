@@ -0,0 +1,100 @@
+import asyncio
+import json
+import time
+
+import pytest
+from fakeredis import FakeServer, FakeStrictRedis, aioredis
+
+from cloud_utils.cache.stores import circuit_breaker, redis, redis_sync
+
+
+async def test_circuit_opens_and_recovers():
+    server = FakeServer()
+    transitions = []
+    get_item, set_item = redis.make_store(
+        lambda: aioredis.FakeRedis(server=server),
+        0,
+        0,
+        "breaker",
+        json.dumps,
+        json.loads,
+        guard=circuit_breaker.make_circuit_breaker(
+            "breaker",
+            failure_threshold=2,
+            reset_timeout=0.05,
+            on_state_change=lambda *transition: transitions.append(transition[1:]),
+        ),
+    )
+    await set_item("1", 1)
+
+    server.connected = False
+    for _ in range(3):
+        with pytest.raises(KeyError):
+            await get_item("1")
+    assert transitions == [("closed", "open")]
+
+    server.connected = True
+    with pytest.raises(KeyError):
+        await get_item("1")  # Still open, redis is not called.
+    await asyncio.sleep(0.1)
+    assert await get_item("1") == 1
+    assert transitions == [
+        ("closed", "open"),
+        ("open", "half_open"),
+        ("half_open", "closed"),
+    ]
+
+
+def test_sync_circuit_reopens_on_failed_probe():
+    server = FakeServer()
+    transitions = []
+    get_item, _ = redis_sync.make_store(
+        lambda: FakeStrictRedis(server=server),
+        0,
+        "breaker",
+        json.dumps,
+        json.loads,
+        guard=circuit_breaker.make_circuit_breaker(
+            "breaker",
+            failure_threshold=1,
+            reset_timeout=0.05,
+            on_state_change=lambda *transition: transitions.append(transition[1:]),
+        ),
+    )
+
+    server.connected = False
+    with pytest.raises(KeyError):
+        get_item("1")
+    time.sleep(0.1)
+    with pytest.raises(KeyError):
+        get_item("1")
+    assert transitions == [
+        ("closed", "open"),
+        ("open", "half_open"),
+        ("half_open", "open"),
+    ]
+
+
+async def test_circuit_lets_another_probe_through_after_cancelled_probe():
+    guard = circuit_breaker.make_circuit_breaker(
+        "breaker",
+        failure_threshold=1,
+        reset_timeout=0.05,
+    )
+
+    async def fail():
+        raise redis.redis.ConnectionError
+
+    async def succeed():
+        return 1
+
+    with pytest.raises(redis.redis.ConnectionError):
+        await guard(fail)()
+    await asyncio.sleep(0.1)
+    with pytest.raises(asyncio.TimeoutError):
+        await asyncio.wait_for(guard(asyncio.sleep)(1), 0.01)  # The probe.
+    with pytest.raises(circuit_breaker.CircuitOpenError):
+        await guard(succeed)()
+
+    await asyncio.sleep(0.1)
+    assert await guard(succeed)() == 1
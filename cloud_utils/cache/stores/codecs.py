@@ -0,0 +1,138 @@
+import functools
+import json
+import pickle
+import zlib
+from typing import Any, Callable, Dict, Iterable, Optional, Tuple
+
+# Every encoded value starts with a header of (magic, serializer id, compression id),
+# so values written with one codec can still be read after switching to another.
+_MAGIC = 0xCC
+_HEADER_SIZE = 3
+_NO_COMPRESSION = 0
+
+Codec = Tuple[Callable[[Any], bytes], Callable[[bytes], Any]]
+
+
+def _json() -> Codec:
+    return (
+        lambda value: json.dumps(value, separators=(",", ":")).encode(),
+        json.loads,
+    )
+
+
+def _pickle() -> Codec:
+    return functools.partial(pickle.dumps, protocol=5), pickle.loads
+
+
+def _msgpack() -> Codec:
+    import msgpack
+
+    return (
+        functools.partial(msgpack.packb, use_bin_type=True),
+        functools.partial(msgpack.unpackb, raw=False),
+    )
+
+
+def _zlib() -> Codec:
+    return zlib.compress, zlib.decompress
+
+
+def _zstd() -> Codec:
+    from compression import zstd  # Standard library from python 3.14.
+
+    return zstd.compress, zstd.decompress
+
+
+def _lz4() -> Codec:
+    import lz4.frame
+
+    return lz4.frame.compress, lz4.frame.decompress
+
+
+_SERIALIZERS: Dict[str, Tuple[int, Callable[[], Codec]]] = {
+    "json": (1, _json),
+    "pickle": (2, _pickle),
+    "msgpack": (3, _msgpack),
+}
+
+_COMPRESSIONS: Dict[str, Tuple[int, Callable[[], Codec]]] = {
+    "zlib": (1, _zlib),
+    "zstd": (2, _zstd),
+    "lz4": (3, _lz4),
+}
+
+
+def register_serializer(name: str, codec_id: int, load: Callable[[], Codec]):
+    """Registers a serializer. `load` returns `(dumps, loads)`, and is called only when the serializer is first used."""
+    if codec_id in {i for i, _ in _SERIALIZERS.values()}:
+        raise ValueError(f"Serializer id {codec_id} is already registered.")
+    _SERIALIZERS[name] = (codec_id, load)
+
+
+def register_compression(name: str, codec_id: int, load: Callable[[], Codec]):
+    """Registers a compression. `load` returns `(compress, decompress)`, and is called only when it is first used."""
+    if codec_id in {i for i, _ in _COMPRESSIONS.values()}:
+        raise ValueError(f"Compression id {codec_id} is already registered.")
+    _COMPRESSIONS[name] = (codec_id, load)
+
+
+@functools.cache
+def _by_id(registry_name: str, codec_id: int) -> Codec:
+    for registered_id, load in (
+        _SERIALIZERS if registry_name == "serializer" else _COMPRESSIONS
+    ).values():
+        if registered_id == codec_id:
+            return load()
+    raise ValueError(f"Unknown {registry_name} id {codec_id}.")
+
+
+def make_codec(
+    serializer: str = "json",
+    compression: Optional[str] = None,
+    compression_threshold: int = 1024,
+    legacy_decoder: Optional[Callable[[bytes], Any]] = None,
+    accept: Iterable[str] = (),
+) -> Codec:
+    """Returns `(encoder, decoder)` to pass to the redis stores.
+
+    Values whose serialized size is at least `compression_threshold` bytes are compressed with `compression`.
+    The decoder reads any registered compression, according to the value's header, but only values written with `serializer`
+    or the serializers in `accept` (e.g. the previous serializer while migrating). Values are not trusted to choose their
+    serializer, as that would let anyone who can write to the cache have them unpickled.
+    Values without a header (written before codecs were used) are decoded with `legacy_decoder`, e.g. `json.loads`.
+    Malformed values raise `ValueError`, which the stores treat as a miss.
+    """
+    serializer_id, _ = _SERIALIZERS[serializer]
+    accepted_ids = {serializer_id, *(_SERIALIZERS[name][0] for name in accept)}
+    dumps, _ = _by_id("serializer", serializer_id)
+    if compression is None:
+        compression_id, compress = _NO_COMPRESSION, None
+    else:
+        compression_id, _ = _COMPRESSIONS[compression]
+        compress, _ = _by_id("compression", compression_id)
+
+    def encoder(value) -> bytes:
+        payload = dumps(value)
+        if compress is not None and len(payload) >= compression_threshold:
+            return bytes((_MAGIC, serializer_id, compression_id)) + compress(payload)
+        return bytes((_MAGIC, serializer_id, _NO_COMPRESSION)) + payload
+
+    def decoder(encoded: bytes):
+        if len(encoded) < _HEADER_SIZE or encoded[0] != _MAGIC:
+            if legacy_decoder is None:
+                raise ValueError("Value has no codec header.")
+            return legacy_decoder(encoded)
+        if encoded[1] not in accepted_ids:
+            raise ValueError(f"Serializer id {encoded[1]} is not accepted.")
+        payload = encoded[_HEADER_SIZE:]
+        try:
+            if encoded[2] != _NO_COMPRESSION:
+                payload = _by_id("compression", encoded[2])[1](payload)
+            return _by_id("serializer", encoded[1])[1](payload)
+        except ValueError:
+            raise
+        # Each library raises its own errors for malformed input.
+        except Exception as err:
+            raise ValueError(f"Malformed value: {err}") from err
+
+    return encoder, decoder
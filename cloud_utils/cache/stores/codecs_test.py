@@ -0,0 +1,92 @@
+import json
+
+import pytest
+from fakeredis import FakeServer, aioredis
+
+from cloud_utils.cache import utils
+from cloud_utils.cache.stores import codecs, redis
+
+_SERVER = FakeServer()
+
+
+def _make_async_fake_redis_client():
+    return aioredis.FakeRedis(server=_SERVER)
+
+
+_VALUE = {"intents": [{"name": "order", "score": 0.9}] * 50, "text": "hello"}
+
+
+@pytest.mark.parametrize("serializer", ["json", "pickle"])
+@pytest.mark.parametrize("compression", [None, "zlib"])
+def test_codec_round_trip(serializer, compression):
+    encoder, decoder = codecs.make_codec(serializer, compression, 100)
+
+    assert decoder(encoder(_VALUE)) == _VALUE
+    assert decoder(encoder(1)) == 1
+
+
+def test_codec_compresses_above_threshold():
+    encoder, _ = codecs.make_codec("json", "zlib", 100)
+
+    assert len(encoder(_VALUE)) < len(json.dumps(_VALUE))
+    assert encoder("small")[3:] == b'"small"'
+
+
+def test_decoder_reads_accepted_codecs_and_legacy_values():
+    json_encoder, _ = codecs.make_codec("json")
+    _, decoder = codecs.make_codec(
+        "pickle",
+        "zlib",
+        legacy_decoder=json.loads,
+        accept=["json"],
+    )
+
+    assert decoder(json_encoder(_VALUE)) == _VALUE
+    assert decoder(json.dumps(_VALUE).encode()) == _VALUE
+
+
+def test_decoder_rejects_serializers_not_accepted():
+    pickle_encoder, _ = codecs.make_codec("pickle")
+    _, decoder = codecs.make_codec("json")
+
+    with pytest.raises(ValueError):
+        decoder(pickle_encoder(_VALUE))
+
+
+def test_register_rejects_taken_ids():
+    with pytest.raises(ValueError):
+        codecs.register_serializer("other_json", 1, lambda: (json.dumps, json.loads))
+
+
+def test_decoder_raises_value_error_on_malformed_values():
+    encoder, decoder = codecs.make_codec("pickle", "zlib", 0)
+
+    with pytest.raises(ValueError):
+        decoder(encoder(_VALUE)[:-5])
+    with pytest.raises(ValueError):
+        decoder(b"no header")
+
+
+async def test_redis_store_with_codec():
+    get_item, set_item = redis.make_store(
+        _make_async_fake_redis_client,
+        0,
+        0,
+        "codec_store",
+        *codecs.make_codec("pickle", "zlib", 100, json.loads),
+    )
+
+    await set_item("1", _VALUE)
+    await _make_async_fake_redis_client().set(
+        utils.cache_key_name("codec_store", "2"),
+        "[2]",
+    )
+    await _make_async_fake_redis_client().set(
+        utils.cache_key_name("codec_store", "3"),
+        b"\xcc\x01\x00{",
+    )
+
+    assert await get_item("1") == _VALUE
+    assert await get_item("2") == [2]
+    with pytest.raises(KeyError):
+        await get_item("3")
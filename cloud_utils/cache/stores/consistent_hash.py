@@ -0,0 +1,32 @@
+import bisect
+import hashlib
+from typing import Callable, Iterable
+
+
+def _hash(value: str) -> int:
+    # Stable across processes, unlike `hash`.
+    return int.from_bytes(
+        hashlib.blake2b(value.encode(), digest_size=8).digest(),
+        "big",
+    )
+
+
+def make_ring(shards: Iterable[str], virtual_nodes: int = 160) -> Callable[[str], str]:
+    """Returns `shard_for(key)`, mapping keys to `shards` with consistent hashing.
+
+    Each shard is placed at `virtual_nodes` points on the ring according to its name, so keys spread evenly,
+    and adding or removing a shard only remaps the keys it gains or owned (about 1/N of them).
+    """
+    points = sorted(
+        (_hash(f"{shard}#{node}"), shard)
+        for shard in shards
+        for node in range(virtual_nodes)
+    )
+    if not points:
+        raise ValueError("At least one shard and one virtual node are required.")
+    hashes = [point for point, _ in points]
+
+    def shard_for(key: str) -> str:
+        return points[bisect.bisect(hashes, _hash(key)) % len(points)][1]
+
+    return shard_for
@@ -0,0 +1,30 @@
+import collections
+
+import pytest
+
+from cloud_utils.cache.stores import consistent_hash
+
+_KEYS = [f"key{i}" for i in range(10_000)]
+
+
+def test_ring_spreads_keys_evenly():
+    shard_for = consistent_hash.make_ring(["a", "b", "c", "d"])
+    counts = collections.Counter(map(shard_for, _KEYS))
+    assert set(counts) == {"a", "b", "c", "d"}
+    assert all(1_500 < count < 3_500 for count in counts.values())
+
+
+def test_ring_remaps_only_keys_of_changed_shard():
+    before = consistent_hash.make_ring(["a", "b", "c", "d"])
+    after = consistent_hash.make_ring(["a", "b", "c", "d", "e"])
+    moved = [key for key in _KEYS if before(key) != after(key)]
+    assert all(after(key) == "e" for key in moved)
+    assert len(moved) < len(_KEYS) / 3
+
+    removed = consistent_hash.make_ring(["a", "b", "c"])
+    assert all(removed(key) == before(key) for key in _KEYS if before(key) != "d")
+
+
+def test_ring_requires_shards():
+    with pytest.raises(ValueError):
+        consistent_hash.make_ring([])
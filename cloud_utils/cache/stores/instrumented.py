@@ -0,0 +1,155 @@
+import bisect
+import collections
+import functools
+import time
+from typing import Callable, Dict, List, Optional, Tuple
+
+from cloud_utils import datadog
+
+GET = "get"
+SET = "set"
+
+# Latency histogram bucket upper bounds, from 1 microsecond to about a minute.
+_BUCKETS = tuple(1e-6 * 2**i for i in range(27))
+_PERCENTILES = (50, 95, 99)
+
+Exporter = Callable[[str, float, List[str]], None]
+
+
+def _record_latency(stats: collections.Counter, operation: str, start: float):
+    bucket = bisect.bisect_left(_BUCKETS, time.perf_counter() - start)
+    stats[(operation, min(bucket, len(_BUCKETS) - 1))] += 1
+
+
+def make_store(
+    get_item: Callable,
+    set_item: Callable,
+    stats: collections.Counter,
+) -> Tuple[Callable, Callable]:
+    """Records `hit`, `miss`, `error` and `set` counts and get/set latency histograms of a store in `stats`, see `export`."""
+
+    def instrumented_get_item(key: str):
+        start = time.perf_counter()
+        try:
+            value = get_item(key)
+        except KeyError:
+            stats["miss"] += 1
+            raise
+        except Exception:
+            stats["error"] += 1
+            raise
+        finally:
+            _record_latency(stats, GET, start)
+        stats["hit"] += 1
+        return value
+
+    def instrumented_set_item(key: str, value):
+        start = time.perf_counter()
+        try:
+            set_item(key, value)
+        except Exception:
+            stats["error"] += 1
+            raise
+        finally:
+            _record_latency(stats, SET, start)
+        stats["set"] += 1
+
+    return instrumented_get_item, instrumented_set_item
+
+
+def make_async_store(
+    get_item: Callable,
+    set_item: Callable,
+    stats: collections.Counter,
+) -> Tuple[Callable, Callable]:
+    """Async version of `make_store`."""
+
+    async def instrumented_get_item(key: str):
+        start = time.perf_counter()
+        try:
+            value = await get_item(key)
+        except KeyError:
+            stats["miss"] += 1
+            raise
+        except Exception:
+            stats["error"] += 1
+            raise
+        finally:
+            _record_latency(stats, GET, start)
+        stats["hit"] += 1
+        return value
+
+    async def instrumented_set_item(key: str, value):
+        start = time.perf_counter()
+        try:
+            await set_item(key, value)
+        except Exception:
+            stats["error"] += 1
+            raise
+        finally:
+            _record_latency(stats, SET, start)
+        stats["set"] += 1
+
+    return instrumented_get_item, instrumented_set_item
+
+
+def _percentile(stats: collections.Counter, operation: str, percentile: int):
+    counts = [stats[(operation, bucket)] for bucket in range(len(_BUCKETS))]
+    total = sum(counts)
+    if not total:
+        return None
+    cumulative = 0
+    for bound, count in zip(_BUCKETS, counts):
+        cumulative += count
+        if cumulative * 100 >= total * percentile:
+            return bound
+    return _BUCKETS[-1]
+
+
+def export(
+    name: str,
+    stats: collections.Counter,
+    exporter: Exporter,
+    extra_tags: Optional[List[str]] = None,
+):
+    """Sends the metrics recorded in `stats` since the last export as `cache.*` metrics tagged with `cache:{name}`, and resets them.
+
+    Latency percentiles are reported as the upper bound of their histogram bucket.
+    """
+    snapshot = stats.copy()
+    stats.clear()
+    tags = [f"cache:{name}", *(extra_tags or [])]
+    for count, metric in (
+        ("hit", "cache.hits"),
+        ("miss", "cache.misses"),
+        ("error", "cache.errors"),
+        ("set", "cache.sets"),
+    ):
+        exporter(metric, snapshot[count], tags)
+    if snapshot["hit"] + snapshot["miss"]:
+        exporter(
+            "cache.hit_ratio",
+            snapshot["hit"] / (snapshot["hit"] + snapshot["miss"]),
+            tags,
+        )
+    for operation in (GET, SET):
+        for percentile in _PERCENTILES:
+            latency = _percentile(snapshot, operation, percentile)
+            if latency is not None:
+                exporter(f"cache.{operation}.latency.p{percentile}", latency, tags)
+
+
+def make_in_memory_exporter() -> (
+    Tuple[Exporter, Dict[Tuple[str, Tuple[str, ...]], float]]
+):
+    """Returns an exporter and the dict of `(metric, tags)` to last exported value it writes to, for tests."""
+    exported: Dict[Tuple[str, Tuple[str, ...]], float] = {}
+
+    def exporter(metric: str, value: float, tags: List[str]):
+        exported[(metric, tuple(tags))] = value
+
+    return exporter, exported
+
+
+def datadog_exporter(api_key: str) -> Exporter:
+    return functools.partial(datadog.send_metric, api_key)
@@ -0,0 +1,49 @@
+import collections
+
+import pytest
+
+from cloud_utils.cache.stores import instrumented, lru_memory
+
+_TAGS = ("cache:instrumented",)
+
+
+def test_instrumented_store_exports_counts_and_latencies():
+    stats: collections.Counter = collections.Counter()
+    get_item, set_item = instrumented.make_store(
+        *lru_memory.make_store(10, "instrumented"),
+        stats,
+    )
+    exporter, exported = instrumented.make_in_memory_exporter()
+
+    set_item("1", 1)
+    get_item("1")
+    get_item("1")
+    with pytest.raises(KeyError):
+        get_item("2")
+    instrumented.export("instrumented", stats, exporter)
+
+    assert exported[("cache.hits", _TAGS)] == 2
+    assert exported[("cache.misses", _TAGS)] == 1
+    assert exported[("cache.sets", _TAGS)] == 1
+    assert exported[("cache.errors", _TAGS)] == 0
+    assert exported[("cache.hit_ratio", _TAGS)] == 2 / 3
+    assert 0 < exported[("cache.get.latency.p99", _TAGS)] < 1
+    assert not stats
+
+
+async def test_instrumented_async_store_counts_errors():
+    stats: collections.Counter = collections.Counter()
+
+    async def get_item(key):
+        raise ConnectionError
+
+    async def set_item(key, value):
+        pass
+
+    get_item, set_item = instrumented.make_async_store(get_item, set_item, stats)
+    with pytest.raises(ConnectionError):
+        await get_item("1")
+    await set_item("1", 1)
+
+    assert stats["error"] == 1
+    assert stats["set"] == 1
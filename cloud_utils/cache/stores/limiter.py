@@ -0,0 +1,124 @@
+import asyncio
+import collections
+import time
+from typing import Callable, Deque, Dict, Optional
+
+GET = "get"
+SET = "set"
+
+
+def make_limiter(
+    max_parallelism: int,
+    set_share: float = 0.2,
+    latency_target: float = 0,
+    min_parallelism: int = 1,
+    stats: Optional[collections.Counter] = None,
+) -> Callable[[str, Callable], Callable]:
+    """Returns `throttle(kind, f)`, limiting all throttled coroutines together to `max_parallelism` concurrent calls.
+
+    Size `max_parallelism` to the redis connection pool, and share one limiter between the stores using that pool.
+    When both `GET` and `SET` calls are waiting, gets are preferred but sets get at least `set_share` of the freed slots.
+    With `latency_target` (seconds), the limit is adjusted AIMD style: halved when a call is slower than the target,
+    and increased by one after a limit's worth of calls within it.
+    If `stats` is given, `{kind}_queue_depth`, `{kind}_waits`, `{kind}_wait_seconds`, `{kind}_max_wait_seconds` and `limit` are kept in it.
+    """
+    if not 0 < set_share < 1:
+        raise ValueError(f"set_share must be between 0 and 1, got {set_share}.")
+    if stats is None:
+        stats = collections.Counter()
+    limit = max_parallelism
+    in_use = 0
+    gets_since_set = 0
+    calls_within_target = 0
+    calls_since_decrease = 0
+    waiters: Dict[str, Deque[asyncio.Future]] = {
+        GET: collections.deque(),
+        SET: collections.deque(),
+    }
+    stats["limit"] = limit
+
+    def next_waiter() -> Optional[asyncio.Future]:
+        nonlocal gets_since_set
+        if waiters[SET] and (
+            not waiters[GET] or gets_since_set + 1 >= round(1 / set_share)
+        ):
+            gets_since_set = 0
+            return waiters[SET].popleft()
+        if waiters[GET]:
+            gets_since_set += 1
+            return waiters[GET].popleft()
+        return None
+
+    def wake():
+        nonlocal in_use
+        while in_use < limit:
+            waiter = next_waiter()
+            if waiter is None:
+                break
+            if waiter.done():  # Cancelled while waiting.
+                continue
+            in_use += 1
+            waiter.set_result(None)
+        for kind, queue in waiters.items():
+            stats[f"{kind}_queue_depth"] = len(queue)
+
+    def release():
+        nonlocal in_use
+        in_use -= 1
+        wake()
+
+    async def acquire(kind: str):
+        nonlocal in_use
+        if in_use < limit and not waiters[GET] and not waiters[SET]:
+            in_use += 1
+            return
+        waiter = asyncio.get_running_loop().create_future()
+        waiters[kind].append(waiter)
+        wake()  # There may be free slots if all waiters ahead were cancelled.
+        start = time.perf_counter()
+        try:
+            await waiter
+        except asyncio.CancelledError:
+            if waiter.done() and not waiter.cancelled():  # Acquired, then cancelled.
+                release()
+            raise
+        finally:
+            wait = time.perf_counter() - start
+            stats[f"{kind}_waits"] += 1
+            stats[f"{kind}_wait_seconds"] += wait
+            stats[f"{kind}_max_wait_seconds"] = max(
+                stats[f"{kind}_max_wait_seconds"],
+                wait,
+            )
+
+    def adjust(latency: float):
+        nonlocal limit, calls_within_target, calls_since_decrease
+        calls_since_decrease += 1
+        if latency > latency_target:
+            calls_within_target = 0
+            # Calls started before the last decrease should not decrease it again.
+            if calls_since_decrease >= limit:
+                limit = max(min_parallelism, limit // 2)
+                calls_since_decrease = 0
+        else:
+            calls_within_target += 1
+            if calls_within_target >= limit:
+                limit = min(max_parallelism, limit + 1)
+                calls_within_target = 0
+                wake()
+        stats["limit"] = limit
+
+    def throttle(kind: str, f: Callable) -> Callable:
+        async def throttled(*args, **kwargs):
+            await acquire(kind)
+            start = time.perf_counter()
+            try:
+                return await f(*args, **kwargs)
+            finally:
+                if latency_target:
+                    adjust(time.perf_counter() - start)
+                release()
+
+        return throttled
+
+    return throttle
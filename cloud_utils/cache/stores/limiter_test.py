@@ -0,0 +1,70 @@
+import asyncio
+import collections
+
+import pytest
+
+from cloud_utils.cache.stores import limiter
+
+
+async def test_limiter_bounds_get_and_set_together():
+    throttle = limiter.make_limiter(3)
+    running = 0
+    max_running = 0
+
+    async def f():
+        nonlocal running, max_running
+        running += 1
+        max_running = max(max_running, running)
+        await asyncio.sleep(0.01)
+        running -= 1
+
+    await asyncio.gather(
+        *(throttle(limiter.GET, f)() for _ in range(10)),
+        *(throttle(limiter.SET, f)() for _ in range(10)),
+    )
+    assert max_running == 3
+
+
+async def test_limiter_serves_sets_while_gets_wait():
+    stats: collections.Counter = collections.Counter()
+    throttle = limiter.make_limiter(1, set_share=0.5, stats=stats)
+    order = []
+
+    def make_call(kind):
+        async def call():
+            order.append(kind)
+            await asyncio.sleep(0)
+
+        return throttle(kind, call)
+
+    await asyncio.gather(
+        *(make_call(limiter.GET)() for _ in range(4)),
+        *(make_call(limiter.SET)() for _ in range(2)),
+    )
+    assert order == ["get", "get", "set", "get", "set", "get"]
+    assert stats["get_waits"] == 3
+    assert stats["set_queue_depth"] == 0
+
+
+async def test_limiter_decreases_limit_on_slow_calls():
+    stats: collections.Counter = collections.Counter()
+    throttle = limiter.make_limiter(8, latency_target=0.001, stats=stats)
+
+    async def slow():
+        await asyncio.sleep(0.01)
+
+    await asyncio.gather(*(throttle(limiter.GET, slow)() for _ in range(16)))
+    assert stats["limit"] < 8
+
+    async def fast():
+        pass
+
+    for _ in range(100):
+        await throttle(limiter.GET, fast)()
+    assert stats["limit"] == 8
+
+
+@pytest.mark.parametrize("set_share", [0, 1, 1.5])
+def test_limiter_rejects_invalid_set_share(set_share):
+    with pytest.raises(ValueError):
+        limiter.make_limiter(2, set_share=set_share)
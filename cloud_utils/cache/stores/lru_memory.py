@@ -1,27 +1,93 @@
 import collections
+import os
+import sys
+import tempfile
+import threading
+import time
+from typing import Any, Callable
 
 import gamla
 
 from cloud_utils.cache import utils
+from cloud_utils.cache.stores import mmap, negative
 
+_SHARED_MEMORY_PATH = "/dev/shm/cloud_utils_cache"
 
-def make_store(max_size: int, name: str):
+
+class _Entry:
+    """A value with its accounted size and expiry time, used only when a byte budget or ttl is set."""
+
+    __slots__ = ("value", "size", "expires_at")
+
+    def __init__(self, value, size: int, expires_at: float):
+        self.value = value
+        self.size = size
+        self.expires_at = expires_at
+
+
+def make_store(
+    max_size: int,
+    name: str,
+    max_bytes: int = 0,
+    sizer: Callable[[Any], int] = sys.getsizeof,
+    ttl: float = 0,
+    negative_ttl: float = 0,
+):
+    """An in memory LRU store bounded to `max_size` entries (0 for unbounded).
+
+    With `max_bytes`, least recently used entries are also evicted while the total `sizer(value)` exceeds it.
+    With `ttl`, entries expire `ttl` seconds after they are set.
+    With `negative_ttl`, `negative.ABSENT` values are kept as negative entries for that many seconds.
+    """
     utils.log_initialized_cache("lru", name)
-    store = collections.OrderedDict()
+    store: collections.OrderedDict = collections.OrderedDict()
+    total_bytes = 0
+    with_entries = bool(max_bytes or ttl)
+
+    def evict():
+        nonlocal total_bytes
+        while max_size and len(store) > max_size:
+            _, evicted = store.popitem(last=False)  # Pop least recently used key.
+            if with_entries:
+                total_bytes -= evicted.size
+        while max_bytes and total_bytes > max_bytes:
+            _, evicted = store.popitem(last=False)
+            total_bytes -= evicted.size
 
     def set_item(key: str, value):
+        nonlocal total_bytes
         cache_key = utils.cache_key_name(name, key)
-        store[cache_key] = value
-
-        if max_size and len(store) > max_size and max_size != 0:
-            store.popitem(last=False)  # Pop least recently used key.
+        if with_entries:
+            previous = store.pop(cache_key, None)
+            if previous is not None:
+                total_bytes -= previous.size
+            entry = _Entry(
+                value,
+                sizer(value) if max_bytes else 0,
+                time.monotonic() + ttl if ttl else 0,
+            )
+            total_bytes += entry.size
+            store[cache_key] = entry
+        else:
+            store[cache_key] = value
+            store.move_to_end(cache_key)
+        evict()
 
     def get_item(key: str):
+        nonlocal total_bytes
         cache_key = utils.cache_key_name(name, key)
         item = store[cache_key]
-        store[cache_key] = item  # Touch key, for LRU.
-        return item
+        store.move_to_end(cache_key)  # Touch key, for LRU.
+        if not with_entries:
+            return item
+        if item.expires_at and time.monotonic() >= item.expires_at:
+            del store[cache_key]
+            total_bytes -= item.size
+            raise KeyError(key)
+        return item.value
 
+    if negative_ttl:
+        return negative.make_store(get_item, set_item, negative_ttl)
     return get_item, set_item
 
 
@@ -30,3 +96,53 @@ make_async_store = gamla.compose_left(
     gamla.map(gamla.wrap_awaitable),
     tuple,
 )
+
+
+def _split(total: int, parts: int, part: int) -> int:
+    return total // parts + (part < total % parts)
+
+
+def make_thread_safe_store(max_size: int, name: str, stripes: int = 16, **kwargs):
+    """Same as `make_store`, safe to use from multiple threads.
+
+    Keys are spread over `stripes` independent stores, each with its own lock, so threads rarely contend.
+    `max_size` and `max_bytes` are split between the stripes so their shares add up to the global bound,
+    and eviction is LRU per stripe. There are never more stripes than `max_size` entries or `max_bytes` bytes.
+    """
+    max_bytes = kwargs.get("max_bytes", 0)
+    stripes = min(stripes, max_size or stripes, max_bytes or stripes)
+    stores = tuple(
+        make_store(
+            _split(max_size, stripes, index),
+            name,
+            **{**kwargs, "max_bytes": _split(max_bytes, stripes, index)},
+        )
+        for index in range(stripes)
+    )
+    locks = tuple(threading.Lock() for _ in range(stripes))
+
+    def stripe(key: str) -> int:
+        return hash(key) % stripes
+
+    def get_item(key: str):
+        index = stripe(key)
+        with locks[index]:
+            return stores[index][0](key)
+
+    def set_item(key: str, value):
+        index = stripe(key)
+        with locks[index]:
+            stores[index][1](key, value)
+
+    return get_item, set_item
+
+
+def make_shared_store(max_size: int, name: str, path: str = _SHARED_MEMORY_PATH):
+    """A store shared by all processes on the host, backed by memory mapped files in shared memory (`/dev/shm`).
+
+    Any process can read or write. Values are pickled. Instead of LRU eviction, the store is cleared when it exceeds `max_size`.
+    """
+    if path == _SHARED_MEMORY_PATH and not os.path.isdir(os.path.dirname(path)):
+        # No shared memory file system (e.g. macOS), fall back to the temp dir which is usually in the page cache.
+        path = os.path.join(tempfile.gettempdir(), os.path.basename(path))
+    return mmap.make_store(path, name, max_size, multiprocess_writers=True)
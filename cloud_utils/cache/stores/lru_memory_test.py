@@ -1,3 +1,7 @@
+import concurrent.futures
+import multiprocessing
+import time
+
 import pytest
 
 from cloud_utils.cache.stores import lru_memory
@@ -29,3 +33,132 @@ def test_store_unbounded():
     assert get_item("1") == 1
     assert get_item("2") == 2
     assert get_item("3") == 3
+
+
+def test_store_touches_key_on_get_and_set():
+    get_item, set_item = lru_memory.make_store(2, "touched_store")
+
+    set_item("1", 1)
+    set_item("2", 2)
+    get_item("1")
+    set_item("3", 3)
+    set_item("1", 10)
+    set_item("4", 4)
+
+    with pytest.raises(KeyError):
+        get_item("2")
+    with pytest.raises(KeyError):
+        get_item("3")
+    assert get_item("1") == 10
+    assert get_item("4") == 4
+
+
+def test_store_bounded_bytes():
+    get_item, set_item = lru_memory.make_store(
+        0,
+        "bytes_store",
+        max_bytes=10,
+        sizer=len,
+    )
+
+    set_item("1", "aaaa")
+    set_item("2", "bbbb")
+    get_item("1")
+    set_item("3", "cccc")
+
+    with pytest.raises(KeyError):
+        get_item("2")
+    assert get_item("1") == "aaaa"
+    assert get_item("3") == "cccc"
+
+    set_item("4", "d" * 11)
+    with pytest.raises(KeyError):
+        get_item("4")
+
+
+def test_store_ttl():
+    get_item, set_item = lru_memory.make_store(0, "ttl_store", ttl=0.05)
+
+    set_item("1", 1)
+    assert get_item("1") == 1
+    time.sleep(0.1)
+    with pytest.raises(KeyError):
+        get_item("1")
+
+
+def test_thread_safe_store():
+    get_item, set_item = lru_memory.make_thread_safe_store(0, "threads_store")
+
+    with concurrent.futures.ThreadPoolExecutor(8) as executor:
+        list(executor.map(lambda x: set_item(f"{x}", x), range(1_000)))
+        assert list(executor.map(lambda x: get_item(f"{x}"), range(1_000))) == list(
+            range(1_000),
+        )
+
+
+def _set_in_other_process(path, key, value):
+    _, set_item = lru_memory.make_shared_store(100, "shared_store", path)
+    set_item(key, value)
+
+
+def test_shared_store_across_processes(tmp_path):
+    get_item, set_item = lru_memory.make_shared_store(
+        100,
+        "shared_store",
+        tmp_path / "shm",
+    )
+    set_item("1", 1)
+
+    process = multiprocessing.get_context("fork").Process(
+        target=_set_in_other_process,
+        args=(tmp_path / "shm", "2", 2),
+    )
+    process.start()
+    process.join()
+
+    assert get_item("1") == 1
+    assert get_item("2") == 2
+
+
+def test_shared_store_cleared_beyond_max_size(tmp_path):
+    get_item, set_item = lru_memory.make_shared_store(2, "shared_store", tmp_path)
+
+    set_item("1", 1)
+    set_item("2", 2)
+    set_item("3", 3)
+
+    with pytest.raises(KeyError):
+        get_item("1")
+    assert get_item("3") == 3
+
+
+def test_shared_store_cleared_after_many_overwrites(tmp_path):
+    get_item, set_item = lru_memory.make_shared_store(10, "shared_store", tmp_path)
+
+    for value in range(1_000):
+        set_item("1", value)
+
+    assert get_item("1") == 999
+    assert sum(path.stat().st_size for path in tmp_path.rglob("*.data")) < 1_000
+
+
+def test_thread_safe_store_bounded_globally():
+    get_item, set_item = lru_memory.make_thread_safe_store(1, "threads_store")
+
+    for x in range(100):
+        set_item(f"{x}", x)
+
+    assert get_item("99") == 99
+    for x in range(99):
+        with pytest.raises(KeyError):
+            get_item(f"{x}")
+
+
+def test_shared_store_creates_missing_directories(tmp_path):
+    path = tmp_path / "missing" / "shm"
+    get_item, set_item = lru_memory.make_shared_store(10, "shared_store", str(path))
+
+    set_item("1", 1)
+
+    assert get_item("1") == 1
+    assert path.is_dir()
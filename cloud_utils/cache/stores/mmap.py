@@ -0,0 +1,257 @@
+import contextlib
+import fcntl
+import hashlib
+import logging
+import mmap
+import os
+import pickle
+import struct
+from typing import Any, Callable, ContextManager, Optional, Tuple
+
+import gamla
+
+from cloud_utils.cache import utils
+from cloud_utils.cache.stores import negative
+
+# Index file: a header followed by an open addressing hash table of (key hash, record offset) slots.
+# Data file: length prefixed pickled (cache key, value) records, appended on every write.
+_MAGIC = b"CUM2"
+# Magic, stale flag, capacity, count, records in the data file.
+_HEADER = struct.Struct("<4sIQQQ")
+_SLOT = struct.Struct("<QQ")
+_UINT64 = struct.Struct("<Q")
+_INITIAL_CAPACITY = 1024
+_MAX_LOAD = 0.5
+
+
+def _key_hash(cache_key: str) -> int:
+    # Stable across processes (unlike `hash`), and never 0, which marks an empty slot.
+    return (
+        int.from_bytes(
+            hashlib.blake2b(cache_key.encode(), digest_size=8).digest(),
+            "little",
+        )
+        or 1
+    )
+
+
+def _create_index(path: str, capacity: int):
+    with open(path, "wb") as index_file:
+        index_file.write(_HEADER.pack(_MAGIC, 0, capacity, 0, 0))
+        index_file.truncate(_HEADER.size + capacity * _SLOT.size)
+
+
+def _map(path: str, access: int = mmap.ACCESS_WRITE) -> mmap.mmap:
+    with open(path, "r+b" if access == mmap.ACCESS_WRITE else "rb") as f:
+        return mmap.mmap(f.fileno(), 0, access=access)
+
+
+def _slot_position(slot: int) -> int:
+    return _HEADER.size + slot * _SLOT.size
+
+
+@contextlib.contextmanager
+def _file_lock(path: str):
+    with open(path, "ab") as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+def _open_index(
+    index_path: str,
+    data_path: str,
+    name: str,
+    lock: ContextManager,
+) -> mmap.mmap:
+    with lock:
+        if not os.path.exists(index_path):
+            _create_index(index_path, _INITIAL_CAPACITY)
+        open(data_path, "ab").close()
+        index = _map(index_path)
+        if _HEADER.unpack_from(index)[0] == _MAGIC:
+            return index
+        logging.error(
+            f"Cache {name} has an invalid index. Initializing an empty cache.",
+        )
+        index.close()
+        _create_index(index_path, _INITIAL_CAPACITY)
+        open(data_path, "wb").close()
+        return _map(index_path)
+
+
+def make_store(
+    cache_path: str,
+    name: str,
+    max_size: int = 0,
+    multiprocess_writers: bool = False,
+    negative_ttl: float = 0,
+) -> Tuple[Callable, Callable]:
+    """A disk backed store which maps its files into memory instead of loading them.
+
+    Opening the store is O(1), only the pages of entries which are read are loaded, and forked processes share them.
+    Processes may read concurrently. Only one process should write to a store, unless `multiprocess_writers` is set,
+    in which case writes are serialized with a lock file.
+    Overwritten values are not reclaimed from the data file. With `max_size`, the store is cleared when it grows beyond it,
+    or when the data file holds twice as many records (e.g. from overwrites).
+    With `negative_ttl`, `negative.ABSENT` values are kept as negative entries for that many seconds.
+    """
+    utils.log_initialized_cache("mmap", name)
+    os.makedirs(cache_path, exist_ok=True)
+    index_path = os.path.join(cache_path, f"{name}.index")
+    data_path = os.path.join(cache_path, f"{name}.data")
+    lock_path = os.path.join(cache_path, f"{name}.lock")
+    index = _open_index(
+        index_path,
+        data_path,
+        name,
+        _file_lock(lock_path) if multiprocess_writers else contextlib.nullcontext(),
+    )
+    data: Optional[mmap.mmap] = None
+    data_file = None
+
+    def refresh_index():
+        # The index file is replaced when it grows or is cleared, the replaced file is flagged as stale.
+        nonlocal index, data, data_file
+        if _HEADER.unpack_from(index)[1]:
+            index.close()
+            index = _map(index_path)
+            # The data file may have been replaced too.
+            data = None
+            if data_file is not None:
+                data_file.close()
+                data_file = None
+
+    def read_record(offset: int) -> Tuple[str, Any]:
+        nonlocal data
+        if data is None or offset + _UINT64.size > len(data):
+            data = _map(data_path, mmap.ACCESS_READ)
+        (length,) = _UINT64.unpack_from(data, offset)
+        start = offset + _UINT64.size
+        end = start + length
+        if end > len(data):
+            data = _map(data_path, mmap.ACCESS_READ)
+        return pickle.loads(data[start:end])
+
+    def probe(cache_key: str) -> Tuple[int, Optional[Tuple[str, Any]]]:
+        """Returns the slot position of `cache_key` and its record, or the empty slot position it belongs in and `None`."""
+        capacity = _HEADER.unpack_from(index)[2]
+        key_hash = _key_hash(cache_key)
+        slot = key_hash % capacity
+        while True:
+            position = _slot_position(slot)
+            slot_hash, offset = _SLOT.unpack_from(index, position)
+            if slot_hash == 0:
+                return position, None
+            if slot_hash == key_hash:
+                record = read_record(offset)
+                if record[0] == cache_key:
+                    return position, record
+            slot = (slot + 1) % capacity
+
+    def append_record(cache_key: str, value) -> int:
+        nonlocal data_file
+        if data_file is None:
+            data_file = open(data_path, "ab")
+        record = pickle.dumps((cache_key, value), protocol=pickle.HIGHEST_PROTOCOL)
+        offset = data_file.seek(0, os.SEEK_END)
+        data_file.write(_UINT64.pack(len(record)) + record)
+        data_file.flush()
+        return offset
+
+    def replace_index(new_index: mmap.mmap, temp_path: str):
+        nonlocal index
+        new_index.flush()
+        os.replace(temp_path, index_path)
+        _, _, capacity, count, records = _HEADER.unpack_from(index)
+        _HEADER.pack_into(index, 0, _MAGIC, 1, capacity, count, records)
+        index.close()
+        index = new_index
+
+    def clear():
+        nonlocal data, data_file
+        _, _, _, count, records = _HEADER.unpack_from(index)
+        temp_path = f"{index_path}.tmp"
+        _create_index(temp_path, _INITIAL_CAPACITY)
+        new_index = _map(temp_path)
+        if data_file is not None:
+            data_file.close()
+            data_file = None
+        data = None
+        # Replace rather than truncate the data file, processes still reading it keep a valid mapping.
+        open(f"{data_path}.tmp", "wb").close()
+        os.replace(f"{data_path}.tmp", data_path)
+        replace_index(new_index, temp_path)
+        logging.info(
+            f"Cleared cache {name} after it reached {count:,} items in {records:,} records.",
+        )
+
+    def grow():
+        _, _, capacity, count, records = _HEADER.unpack_from(index)
+        new_capacity = capacity * 2
+        temp_path = f"{index_path}.tmp"
+        _create_index(temp_path, new_capacity)
+        new_index = _map(temp_path)
+        for slot in range(capacity):
+            slot_hash, offset = _SLOT.unpack_from(index, _slot_position(slot))
+            if slot_hash == 0:
+                continue
+            new_slot = slot_hash % new_capacity
+            while _UINT64.unpack_from(new_index, _slot_position(new_slot))[0]:
+                new_slot = (new_slot + 1) % new_capacity
+            _SLOT.pack_into(new_index, _slot_position(new_slot), slot_hash, offset)
+        _HEADER.pack_into(new_index, 0, _MAGIC, 0, new_capacity, count, records)
+        replace_index(new_index, temp_path)
+        logging.info(f"Grew index of cache {name} to {new_capacity:,} slots.")
+
+    def get_item(key: str):
+        refresh_index()
+        try:
+            _, record = probe(utils.cache_key_name(name, key))
+        except (struct.error, pickle.UnpicklingError, EOFError, ValueError) as err:
+            # Another process cleared the store while this one was reading it.
+            logging.debug(f"Could not read {key} from {name}: {err}")
+            raise KeyError
+        if record is None:
+            raise KeyError
+        return record[1]
+
+    def write(key: str, value):
+        refresh_index()
+        _, _, _, count, records = _HEADER.unpack_from(index)
+        # Overwrites append records too, so also bound the records to keep the data file from growing forever.
+        if max_size and (count >= max_size or records >= 2 * max_size):
+            clear()
+        cache_key = utils.cache_key_name(name, key)
+        offset = append_record(cache_key, value)
+        position, record = probe(cache_key)
+        # Publish the offset before the hash, so readers never follow a slot to a missing record.
+        _UINT64.pack_into(index, position + _UINT64.size, offset)
+        _, _, capacity, count, records = _HEADER.unpack_from(index)
+        if record is not None:
+            _HEADER.pack_into(index, 0, _MAGIC, 0, capacity, count, records + 1)
+            return
+        _UINT64.pack_into(index, position, _key_hash(cache_key))
+        _HEADER.pack_into(index, 0, _MAGIC, 0, capacity, count + 1, records + 1)
+        if count + 1 > capacity * _MAX_LOAD:
+            grow()
+
+    def set_item(key: str, value):
+        if not multiprocess_writers:
+            write(key, value)
+            return
+        with _file_lock(lock_path):
+            write(key, value)
+
+    if negative_ttl:
+        return negative.make_store(get_item, set_item, negative_ttl)
+    return get_item, set_item
+
+
+make_async_store = gamla.compose_left(
+    make_store,
+    gamla.map(gamla.wrap_awaitable),
+    tuple,
+)
@@ -0,0 +1,44 @@
+import pytest
+
+from cloud_utils.cache.stores import mmap
+
+
+def test_mmap_store(tmp_path):
+    get_item, set_item = mmap.make_store(tmp_path, "test-store")
+
+    set_item("1", 1)
+    set_item("2", {"a": [2]})
+    set_item("1", "one")
+
+    assert get_item("1") == "one"
+    assert get_item("2") == {"a": [2]}
+    with pytest.raises(KeyError):
+        get_item("3")
+
+
+def test_mmap_store_persists_and_grows(tmp_path):
+    _, set_item = mmap.make_store(tmp_path, "test-store")
+    for x in range(2_000):
+        set_item(f"{x}", x)
+
+    get_item, _ = mmap.make_store(tmp_path, "test-store")
+    for x in range(2_000):
+        assert get_item(f"{x}") == x
+
+
+def test_mmap_store_reader_sees_writes_after_index_grows(tmp_path):
+    _, set_item = mmap.make_store(tmp_path, "test-store")
+    get_item, _ = mmap.make_store(tmp_path, "test-store")
+
+    set_item("first", 1)
+    assert get_item("first") == 1
+    for x in range(1_000):
+        set_item(f"{x}", x)
+    assert get_item("999") == 999
+
+
+async def test_mmap_store_async(tmp_path):
+    get_item, set_item = mmap.make_async_store(tmp_path, "test-store")
+
+    await set_item("1", 1)
+    assert await get_item("1") == 1
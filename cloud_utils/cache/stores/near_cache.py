@@ -0,0 +1,238 @@
+import asyncio
+import logging
+import math
+import threading
+from typing import Any, Callable, Optional, Tuple
+
+import cachetools
+import gamla
+import redis
+import redis.asyncio as redis_async
+
+from cloud_utils.cache import utils
+
+# Channel on which redis delivers `CLIENT TRACKING` invalidations (RESP2 redirect mode).
+# Stores in near cache mode also publish their own writes here, so invalidation works on servers without tracking.
+INVALIDATION_CHANNEL = "__redis__:invalidate"
+
+
+def _tracking_command(client_id: int, name: str) -> Tuple:
+    return (
+        "CLIENT",
+        "TRACKING",
+        "ON",
+        "REDIRECT",
+        client_id,
+        "BCAST",
+        "PREFIX",
+        utils.cache_key_name(name, ""),
+    )
+
+
+def _invalidated_keys(message) -> Optional[Tuple[str, ...]]:
+    """Returns the invalidated cache keys, or `None` if the whole cache should be dropped (e.g. on `FLUSHALL`)."""
+    data = message["data"]
+    if data is None:
+        return None
+    if isinstance(data, (list, tuple)):
+        return tuple(
+            key.decode() if isinstance(key, bytes) else str(key) for key in data
+        )
+    return (data.decode() if isinstance(data, bytes) else str(data),)
+
+
+def _make_local_cache(max_size: int, ttl: Callable[[Any], int]) -> cachetools.TLRUCache:
+    # Local copies expire with their redis key at the latest, servers without tracking do not invalidate expired keys.
+    def expires_at(_key, value, now: float) -> float:
+        seconds = ttl(value)
+        return now + seconds if seconds else math.inf
+
+    return cachetools.TLRUCache(maxsize=max_size, ttu=expires_at)
+
+
+def _invalidate(local: cachetools.TLRUCache, message):
+    if message["type"] != "message":
+        return
+    keys = _invalidated_keys(message)
+    if keys is None:
+        local.clear()
+        return
+    for key in keys:
+        local.pop(key, None)
+
+
+def make_async_store(
+    make_redis_client: Callable[[], redis_async.Redis],
+    max_size: int,
+    name: str,
+    get_item: Callable,
+    set_item: Callable,
+    ttl: Callable[[Any], int] = gamla.just(0),
+) -> Tuple[Callable, Callable]:
+    """Keeps a local copy of up to `max_size` values read through an async redis store, until they are invalidated.
+
+    Invalidations come from redis `CLIENT TRACKING` (broadcast mode, on the store's key prefix) when the server supports it,
+    and from writes made through near cache stores, which publish the written key.
+    Local copies are only served while the invalidation subscription is alive, and for at most `ttl(value)` seconds
+    (0 for no limit), the ttl of the redis store.
+    """
+    utils.log_initialized_cache("near cache", name)
+    local = _make_local_cache(max_size, ttl)
+    publish_client = None
+    listener: Optional[asyncio.Task] = None
+    subscribed = False
+    invalidation_count = 0
+
+    async def subscribe(pubsub):
+        await pubsub.execute_command("CLIENT", "ID")
+        client_id = await pubsub.parse_response(block=True)
+        await pubsub.execute_command(*_tracking_command(client_id, name))
+        try:
+            await pubsub.parse_response(block=True)
+        except redis_async.ResponseError as err:
+            logging.info(
+                f"redis: client tracking is not available for {name} ({err}), relying on published invalidations.",
+            )
+        await pubsub.subscribe(INVALIDATION_CHANNEL)
+
+    async def listen():
+        nonlocal subscribed, invalidation_count
+        pubsub = make_redis_client().pubsub()
+        try:
+            await subscribe(pubsub)
+            subscribed = True
+            async for message in pubsub.listen():
+                invalidation_count += 1
+                _invalidate(local, message)
+        except (redis_async.ConnectionError, redis_async.TimeoutError) as err:
+            logging.error(f"redis: near cache for {name} lost its subscription: {err}")
+        finally:
+            subscribed = False
+            local.clear()
+            await pubsub.aclose()
+
+    def ensure_listening():
+        nonlocal listener
+        if listener is None or listener.done():
+            listener = asyncio.create_task(listen())
+
+    async def near_get_item(key: str):
+        cache_key = utils.cache_key_name(name, key)
+        ensure_listening()
+        try:
+            return local[cache_key]
+        except KeyError:
+            pass
+        count_before = invalidation_count
+        value = await get_item(key)
+        # Skip caching if an invalidation may have arrived during the read.
+        if subscribed and count_before == invalidation_count:
+            local[cache_key] = value
+        return value
+
+    async def near_set_item(key: str, value):
+        nonlocal publish_client
+        cache_key = utils.cache_key_name(name, key)
+        local.pop(cache_key, None)
+        await set_item(key, value)
+        if publish_client is None:
+            publish_client = make_redis_client()
+        try:
+            await publish_client.publish(INVALIDATION_CHANNEL, cache_key)
+        except (redis_async.ConnectionError, redis_async.TimeoutError) as err:
+            logging.error(f"redis: could not publish invalidation for {key}: {err}")
+
+    return near_get_item, near_set_item
+
+
+def make_store(
+    make_redis_client: Callable[[], redis.Redis],
+    max_size: int,
+    name: str,
+    get_item: Callable,
+    set_item: Callable,
+    ttl: Callable[[Any], int] = gamla.just(0),
+) -> Tuple[Callable, Callable]:
+    """Sync version of `make_async_store`. Invalidations are consumed on a daemon thread."""
+    utils.log_initialized_cache("near cache", name)
+    local = _make_local_cache(max_size, ttl)
+    lock = threading.Lock()
+    publish_client = None
+    listener: Optional[threading.Thread] = None
+    subscribed = False
+    invalidation_count = 0
+
+    def subscribe(pubsub):
+        pubsub.execute_command("CLIENT", "ID")
+        client_id = pubsub.parse_response(block=True)
+        pubsub.execute_command(*_tracking_command(client_id, name))
+        try:
+            pubsub.parse_response(block=True)
+        except redis.ResponseError as err:
+            logging.info(
+                f"redis: client tracking is not available for {name} ({err}), relying on published invalidations.",
+            )
+        pubsub.subscribe(INVALIDATION_CHANNEL)
+
+    def listen(pubsub):
+        nonlocal subscribed, invalidation_count
+        try:
+            for message in pubsub.listen():
+                with lock:
+                    invalidation_count += 1
+                    _invalidate(local, message)
+        except (redis.ConnectionError, redis.TimeoutError) as err:
+            logging.error(f"redis: near cache for {name} lost its subscription: {err}")
+        finally:
+            with lock:
+                subscribed = False
+                local.clear()
+            pubsub.close()
+
+    def ensure_listening():
+        nonlocal listener, subscribed
+        with lock:
+            if listener is not None and listener.is_alive():
+                return
+            pubsub = make_redis_client().pubsub()
+            try:
+                subscribe(pubsub)
+            except (redis.ConnectionError, redis.TimeoutError) as err:
+                logging.error(
+                    f"redis: near cache for {name} could not subscribe: {err}",
+                )
+                pubsub.close()
+                return
+            subscribed = True
+            listener = threading.Thread(target=listen, args=(pubsub,), daemon=True)
+            listener.start()
+
+    def near_get_item(key: str):
+        cache_key = utils.cache_key_name(name, key)
+        ensure_listening()
+        with lock:
+            try:
+                return local[cache_key]
+            except KeyError:
+                count_before = invalidation_count
+        value = get_item(key)
+        with lock:
+            # Skip caching if an invalidation may have arrived during the read.
+            if subscribed and count_before == invalidation_count:
+                local[cache_key] = value
+        return value
+
+    def near_set_item(key: str, value):
+        nonlocal publish_client
+        cache_key = utils.cache_key_name(name, key)
+        with lock:
+            local.pop(cache_key, None)
+        set_item(key, value)
+        if publish_client is None:
+            publish_client = make_redis_client()
+        try:
+            publish_client.publish(INVALIDATION_CHANNEL, cache_key)
+        except (redis.ConnectionError, redis.TimeoutError) as err:
+            logging.error(f"redis: could not publish invalidation for {key}: {err}")
+
+    return near_get_item, near_set_item
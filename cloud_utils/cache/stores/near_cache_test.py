@@ -0,0 +1,93 @@
+import asyncio
+import json
+import time
+
+import pytest
+from fakeredis import FakeServer, FakeStrictRedis, aioredis
+
+from cloud_utils.cache import utils
+from cloud_utils.cache.stores import near_cache, redis, redis_sync
+
+_SERVER = FakeServer()
+
+
+def _make_sync_fake_redis_client():
+    return FakeStrictRedis(server=_SERVER)
+
+
+def _make_async_fake_redis_client():
+    return aioredis.FakeRedis(server=_SERVER)
+
+
+def _make_async_store():
+    return redis.make_store(
+        _make_async_fake_redis_client,
+        0,
+        0,
+        "near",
+        json.dumps,
+        json.loads,
+        near_cache_size=10,
+    )
+
+
+async def test_near_cache_invalidated_by_other_writer():
+    get_item, set_item = _make_async_store()
+    _, other_set_item = _make_async_store()
+    raw_client = _make_async_fake_redis_client()
+
+    await set_item("1", 1)
+    await get_item("1")
+    await asyncio.sleep(0.05)
+    assert await get_item("1") == 1
+
+    # Served locally: a write that bypasses the stores is not seen.
+    await raw_client.set(utils.cache_key_name("near", "1"), "2")
+    assert await get_item("1") == 1
+
+    await other_set_item("1", 3)
+    await asyncio.sleep(0.05)
+    assert await get_item("1") == 3
+
+
+def test_sync_near_cache_invalidated_by_published_key():
+    get_item, set_item = redis_sync.make_store(
+        _make_sync_fake_redis_client,
+        0,
+        "near_sync",
+        json.dumps,
+        json.loads,
+        near_cache_size=10,
+    )
+    raw_client = _make_sync_fake_redis_client()
+
+    set_item("1", 1)
+    assert get_item("1") == 1
+    raw_client.set(utils.cache_key_name("near_sync", "1"), "2")
+    assert get_item("1") == 1
+
+    raw_client.publish(
+        near_cache.INVALIDATION_CHANNEL,
+        utils.cache_key_name("near_sync", "1"),
+    )
+    time.sleep(0.1)
+    assert get_item("1") == 2
+
+
+async def test_near_cache_expires_with_redis_ttl():
+    get_item, set_item = redis.make_store(
+        _make_async_fake_redis_client,
+        0,
+        1,
+        "near_ttl",
+        json.dumps,
+        json.loads,
+        near_cache_size=10,
+    )
+
+    await set_item("1", 1)
+    await get_item("1")
+    await asyncio.sleep(1.5)
+
+    with pytest.raises(KeyError):
+        await get_item("1")
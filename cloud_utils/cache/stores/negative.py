@@ -0,0 +1,116 @@
+import math
+import time
+from typing import Any, Callable, NamedTuple, Tuple
+
+
+class _Absent:
+    __slots__ = ()
+
+    def __repr__(self):
+        return "ABSENT"
+
+    def __reduce__(self):  # Unpickles to the same singleton.
+        return "ABSENT"
+
+
+# Return (or `set_item`) this for keys known not to exist, so that stores keep a negative entry for them.
+ABSENT = _Absent()
+
+
+class _NegativeEntry(NamedTuple):
+    expires_at: float
+
+
+# Marks negative entries at the codec level. Starts with a NUL byte, which json, pickle and `codecs` values never do.
+_MARKER = b"\x00negative:"
+_MARKER_SIZE = len(_MARKER)
+
+
+def encoder(encoder: Callable[[Any], Any]) -> Callable[[Any], Any]:
+    def encode(value):
+        if isinstance(value, _NegativeEntry):
+            return _MARKER + repr(value.expires_at).encode()
+        return encoder(value)
+
+    return encode
+
+
+def decoder(decoder: Callable[[Any], Any]) -> Callable[[Any], Any]:
+    def decode(encoded):
+        # Clients with `decode_responses` return the marker as `str`.
+        marker = _MARKER.decode() if isinstance(encoded, str) else _MARKER
+        if isinstance(encoded, (bytes, str)) and encoded.startswith(marker):
+            return _NegativeEntry(float(encoded[_MARKER_SIZE:]))
+        return decoder(encoded)
+
+    return decode
+
+
+def is_negative(value) -> bool:
+    return isinstance(value, _NegativeEntry)
+
+
+def ttl(ttl: Callable[[Any], int], negative_ttl: float) -> Callable[[Any], int]:
+    def negative_or_ttl(value) -> int:
+        if is_negative(value):
+            return math.ceil(negative_ttl)
+        return ttl(value)
+
+    return negative_or_ttl
+
+
+def absent_ttl(ttl: Callable[[Any], int], negative_ttl: float) -> Callable[[Any], int]:
+    """Same as `ttl`, for values as the negative stores return them (`ABSENT` rather than negative entries)."""
+
+    def absent_or_ttl(value) -> int:
+        if value is ABSENT:
+            return math.ceil(negative_ttl)
+        return ttl(value)
+
+    return absent_or_ttl
+
+
+def _to_stored(value, negative_ttl: float):
+    if value is ABSENT:
+        return _NegativeEntry(time.time() + negative_ttl)
+    return value
+
+
+def _from_stored(stored):
+    if not isinstance(stored, _NegativeEntry):
+        return stored
+    if time.time() >= stored.expires_at:
+        raise KeyError
+    return ABSENT
+
+
+def make_store(
+    get_item: Callable,
+    set_item: Callable,
+    negative_ttl: float,
+) -> Tuple[Callable, Callable]:
+    """Stores `ABSENT` values as negative entries which expire after `negative_ttl` seconds, independently of the store's own ttl."""
+
+    def negative_get_item(key: str):
+        return _from_stored(get_item(key))
+
+    def negative_set_item(key: str, value):
+        set_item(key, _to_stored(value, negative_ttl))
+
+    return negative_get_item, negative_set_item
+
+
+def make_async_store(
+    get_item: Callable,
+    set_item: Callable,
+    negative_ttl: float,
+) -> Tuple[Callable, Callable]:
+    """Async version of `make_store`."""
+
+    async def negative_get_item(key: str):
+        return _from_stored(await get_item(key))
+
+    async def negative_set_item(key: str, value):
+        await set_item(key, _to_stored(value, negative_ttl))
+
+    return negative_get_item, negative_set_item
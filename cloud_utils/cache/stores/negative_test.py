@@ -0,0 +1,119 @@
+import asyncio
+import json
+import pickle as pickle_module
+import time
+
+import pytest
+from fakeredis import FakeServer, FakeStrictRedis, aioredis
+
+from cloud_utils.cache.stores import (
+    lru_memory,
+    negative,
+    pickle,
+    redis,
+    redis_sync,
+    xfetch,
+)
+
+_SERVER = FakeServer()
+
+
+def test_absent_survives_pickling():
+    assert pickle_module.loads(pickle_module.dumps(negative.ABSENT)) is negative.ABSENT
+
+
+def test_lru_memory_negative_entries_expire():
+    get_item, set_item = lru_memory.make_store(10, "negative", negative_ttl=0.05)
+
+    set_item("1", negative.ABSENT)
+    set_item("2", 2)
+    assert get_item("1") is negative.ABSENT
+    assert get_item("2") == 2
+    time.sleep(0.1)
+    with pytest.raises(KeyError):
+        get_item("1")
+    assert get_item("2") == 2
+
+
+def test_pickle_negative_entries_persist(tmp_path):
+    _, set_item = pickle.make_store(tmp_path, "negative", 1, negative_ttl=60)
+    set_item("1", negative.ABSENT)
+
+    get_item, _ = pickle.make_store(tmp_path, "negative", 1, negative_ttl=60)
+    assert get_item("1") is negative.ABSENT
+
+
+async def test_redis_negative_entries_use_negative_ttl():
+    get_item, set_item = redis.make_store(
+        lambda: aioredis.FakeRedis(server=_SERVER),
+        0,
+        0,
+        "negative",
+        json.dumps,
+        json.loads,
+        negative_ttl=30,
+    )
+
+    await set_item("1", negative.ABSENT)
+    await set_item("2", None)
+
+    assert await get_item("1") is negative.ABSENT
+    assert await get_item("2") is None
+    assert 0 < await aioredis.FakeRedis(server=_SERVER).ttl("negative:1") <= 30
+    assert await aioredis.FakeRedis(server=_SERVER).ttl("negative:2") == -1
+
+
+def test_redis_sync_negative_entries():
+    get_item, set_item = redis_sync.make_store(
+        lambda: FakeStrictRedis(server=_SERVER),
+        0,
+        "negative_sync",
+        json.dumps,
+        json.loads,
+        negative_ttl=30,
+    )
+
+    set_item("1", negative.ABSENT)
+
+    assert get_item("1") is negative.ABSENT
+    assert 0 < FakeStrictRedis(server=_SERVER).ttl("negative_sync:1") <= 30
+
+
+async def test_redis_negative_entries_with_str_responses():
+    get_item, set_item = redis.make_store(
+        lambda: aioredis.FakeRedis(server=_SERVER, decode_responses=True),
+        0,
+        0,
+        "negative_str",
+        json.dumps,
+        json.loads,
+        negative_ttl=30,
+    )
+
+    await set_item("1", negative.ABSENT)
+
+    assert await get_item("1") is negative.ABSENT
+
+
+async def test_redis_refresh_to_absent(monkeypatch):
+    async def refresh(key):
+        return negative.ABSENT
+
+    get_item, set_item = redis.make_store(
+        lambda: aioredis.FakeRedis(server=_SERVER),
+        0,
+        60,
+        "negative_refresh",
+        json.dumps,
+        json.loads,
+        xfetch_beta=1,
+        refresh=refresh,
+        negative_ttl=30,
+    )
+    await set_item("1", 1)
+
+    monkeypatch.setattr(xfetch, "should_refresh", lambda *_: True)
+    assert await get_item("1") == 1
+    await asyncio.sleep(0.01)
+    monkeypatch.setattr(xfetch, "should_refresh", lambda *_: False)
+    assert await get_item("1") is negative.ABSENT
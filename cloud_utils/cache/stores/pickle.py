@@ -1,29 +1,120 @@
+import asyncio
+import atexit
+import functools
 import logging
 import os
 import pickle
-from typing import Any, Callable, Dict, Tuple
+import threading
+import time
+from typing import Any, Callable, Dict, Optional, Tuple
 
 import gamla
 
 from cloud_utils.cache import utils
+from cloud_utils.cache.stores import negative
 
 
 def _local_cache_path(cache_name: str, path: str):
     return os.path.join(path, f"{cache_name}.pickle")
 
 
+def _local_log_path(cache_name: str, path: str):
+    return os.path.join(path, f"{cache_name}.pickle.log")
+
+
 @gamla.timeit
-def _load_cache_from_local(cache_name: str, path: str) -> Dict[Tuple, Any]:
+def _load_cache_from_local(cache_name: str, path: str) -> Tuple[Dict[Tuple, Any], int]:
+    """Returns the cache and its generation, which is written after it (snapshots without one are generation 0)."""
     with open(_local_cache_path(cache_name, path), "rb") as local_cache_file:
-        return pickle.load(local_cache_file)
+        cache = pickle.load(local_cache_file)
+        try:
+            return cache, pickle.load(local_cache_file)
+        except EOFError:
+            return cache, 0
+
 
+@gamla.timeit
+def _replay_log(
+    cache_name: str,
+    path: str,
+    cache: Dict[Tuple, Any],
+    generation: int,
+) -> int:
+    """Applies the changes appended since the last snapshot to `cache`, returns how many were applied.
 
-def _save_cache_locally(cache_name: str, path: str, cache: Dict[Tuple, Any]):
+    The log starts with the generation of the snapshot it follows. A log of an older generation (e.g. from a crash
+    after a compaction replaced the snapshot, but before it emptied the log) is already in the snapshot, and is dropped.
+    A partially written trailing entry (e.g. from a crash mid-sync) is truncated.
+    """
+    replayed = 0
+    try:
+        with open(_local_log_path(cache_name, path), "r+b") as log_file:
+            try:
+                logged_generation = pickle.load(log_file)
+            except EOFError:
+                return 0
+            except (pickle.UnpicklingError, ValueError, TypeError):
+                logged_generation = None
+            if logged_generation != generation:
+                logging.warning(
+                    f"Dropping log of cache {cache_name}, it does not follow the snapshot.",
+                )
+                log_file.truncate(0)
+                return 0
+            valid_until = log_file.tell()
+            while True:
+                try:
+                    key, value = pickle.load(log_file)
+                except EOFError:
+                    break
+                except (pickle.UnpicklingError, ValueError, TypeError) as err:
+                    logging.error(
+                        f"Truncating invalid log of cache {cache_name} after {replayed} entries: {err}",
+                    )
+                    break
+                cache[key] = value
+                replayed += 1
+                valid_until = log_file.tell()
+            log_file.truncate(valid_until)
+    except FileNotFoundError:
+        pass
+    return replayed
+
+
+def _append_to_log(
+    cache_name: str,
+    path: str,
+    generation: int,
+    changes: Dict[Tuple, Any],
+):
+    if not os.path.exists(path):
+        os.makedirs(path)
+    with open(_local_log_path(cache_name, path), "ab") as log_file:
+        if not log_file.tell():
+            log_file.write(pickle.dumps(generation))
+        log_file.write(
+            b"".join(pickle.dumps(item) for item in changes.items()),
+        )
+
+
+def _save_cache_locally(
+    cache_name: str,
+    path: str,
+    generation: int,
+    cache: Dict[Tuple, Any],
+):
     if not os.path.exists(path):
         os.makedirs(path)
     local_path = _local_cache_path(cache_name, path)
-    with open(local_path, "wb") as local_cache_file:
+    temp_path = f"{local_path}.tmp"
+    with open(temp_path, "wb") as local_cache_file:
         pickle.dump(cache, local_cache_file)
+        pickle.dump(generation, local_cache_file)
+        local_cache_file.flush()
+        os.fsync(local_cache_file.fileno())
+    os.replace(temp_path, local_path)
+    # The snapshot now includes everything in the log, which is dropped on load if this is not reached.
+    open(_local_log_path(cache_name, path), "wb").close()
     logging.info(f"Saved {len(cache)} cache items locally for {cache_name}.")
 
 
@@ -31,19 +122,120 @@ def make_store(
     cache_path: str,
     name: str,
     sync_threshold: int,
+    write_behind: bool = False,
+    on_sync_duration: Optional[Callable[[float], None]] = None,
+    negative_ttl: float = 0,
 ) -> Tuple[Callable, Callable]:
+    """Every `sync_threshold` changes, the changed entries are appended to a log next to the pickle file.
+
+    Once the log holds more entries than the cache, it is compacted into the pickle file.
+    With `write_behind`, syncs run on a worker thread from a snapshot of the changes, so `set_item` never waits for disk.
+    Syncs requested while one is running are coalesced into one, and pending changes are synced on interpreter exit.
+    `on_sync_duration` is called with the duration in seconds of every sync.
+    With `negative_ttl`, `negative.ABSENT` values are kept as negative entries for that many seconds.
+    """
     change_count = 0
+    changes: Dict[Tuple, Any] = {}
+    lock = threading.Lock()
+    # Serializes writes to the files, e.g. the exit sync must not append to a log a compaction is truncating.
+    sync_lock = threading.Lock()
+    sync_thread: Optional[threading.Thread] = None
+    syncing = False
+    sync_requested = False
     utils.log_initialized_cache("pickle", name)
     # Initialize cache.
     try:
-        cache = _load_cache_from_local(name, cache_path)
+        cache, generation = _load_cache_from_local(name, cache_path)
         logging.info(f"Loaded {len(cache):,} cache items from local file for {name}.")
     except (OSError, IOError, EOFError, pickle.UnpicklingError) as err:
         logging.info(
             f"Cache {name} does not exist or is invalid. Initializing an empty cache.",
         )
         logging.error(err)
-        cache = {}
+        cache, generation = {}, 0
+    log_size = _replay_log(name, cache_path, cache, generation)
+    if log_size:
+        logging.info(f"Replayed {log_size:,} logged changes for {name}.")
+
+    def take_snapshot() -> Tuple[Dict[Tuple, Any], Optional[Dict[Tuple, Any]], int]:
+        """Returns the changes to log, a copy of the cache if it should be compacted instead, and their generation."""
+        nonlocal log_size, generation
+        changed = dict(changes)
+        changes.clear()
+        if log_size + len(changed) > len(cache):
+            log_size = 0
+            generation += 1
+            # A background sync must not iterate the cache while it is being written to.
+            return changed, dict(cache) if write_behind else cache, generation
+        log_size += len(changed)
+        return changed, None, generation
+
+    def sync(
+        changed: Dict[Tuple, Any],
+        snapshot: Optional[Dict[Tuple, Any]],
+        snapshot_generation: int,
+    ):
+        nonlocal log_size
+        start = time.perf_counter()
+        try:
+            with sync_lock:
+                if snapshot is None:
+                    _append_to_log(name, cache_path, snapshot_generation, changed)
+                else:
+                    _save_cache_locally(name, cache_path, snapshot_generation, snapshot)
+        except (OSError, IOError, EOFError) as exception:
+            logging.error(
+                f"Could not sync {name} with local file. Error: {exception}.",
+            )
+            with lock:
+                for key, value in changed.items():
+                    changes.setdefault(key, value)
+                # The log is in an unknown state, compact on the next sync.
+                log_size = len(cache) + 1
+            return
+        duration = time.perf_counter() - start
+        logging.info(
+            f"Synced cache {name} to local file in {duration:.2f} seconds",
+        )
+        if on_sync_duration is not None:
+            on_sync_duration(duration)
+
+    def sync_in_background():
+        nonlocal syncing, sync_requested
+        while True:
+            with lock:
+                changed, snapshot, snapshot_generation = take_snapshot()
+            sync(changed, snapshot, snapshot_generation)
+            with lock:
+                if not sync_requested:
+                    syncing = False
+                    return
+                sync_requested = False
+
+    def request_sync():
+        nonlocal syncing, sync_requested, sync_thread
+        with lock:
+            if syncing:
+                sync_requested = True
+                return
+            syncing = True
+            sync_thread = threading.Thread(target=sync_in_background, daemon=True)
+            sync_thread.start()
+
+    def sync_on_exit():
+        with lock:
+            running_sync = sync_thread
+        # The daemon sync thread is killed at exit, let it finish writing the changes it took.
+        if running_sync is not None:
+            running_sync.join()
+        with lock:
+            if not changes:
+                return
+            changed, snapshot, snapshot_generation = take_snapshot()
+        sync(changed, snapshot, snapshot_generation)
+
+    if write_behind:
+        atexit.register(sync_on_exit)
 
     def get_item(key: str):
         return cache[utils.cache_key_name(name, key)]
@@ -51,30 +243,70 @@ def make_store(
     def set_item(key: str, value):
         nonlocal change_count
 
-        change_count += 1
-        cache[utils.cache_key_name(name, key)] = value
+        with lock:
+            change_count += 1
+            cache[utils.cache_key_name(name, key)] = value
+            changes[utils.cache_key_name(name, key)] = value
+            if change_count < sync_threshold:
+                return
+            change_count -= sync_threshold
 
-        if change_count >= sync_threshold:
-            logging.info(
-                f"{change_count} keys changed in cache {name} (threshold {sync_threshold}). Syncing with local file.",
-            )
+        logging.info(
+            f"{sync_threshold} keys changed in cache {name}. Syncing with local file.",
+        )
+        if write_behind:
+            request_sync()
+            return
+        with lock:
+            changed, snapshot, snapshot_generation = take_snapshot()
+        sync(changed, snapshot, snapshot_generation)
 
-            try:
-                _save_cache_locally(name, cache_path, cache)
-                logging.info(
-                    f"Synced cache {name} to local file",
-                )
-                change_count -= sync_threshold
-            except (OSError, IOError, EOFError) as exception:
-                logging.error(
-                    f"Could not sync {name} with local file. Error: {exception}.",
+    if negative_ttl:
+        return negative.make_store(get_item, set_item, negative_ttl)
+    return get_item, set_item
+
+
+def make_async_store(
+    cache_path: str,
+    name: str,
+    sync_threshold: int,
+    **kwargs,
+) -> Tuple[Callable, Callable]:
+    """Same as `make_store`, without blocking the event loop on disk.
+
+    The cache file is loaded in an executor on first use, and concurrent first callers share that load.
+    Syncs are always written behind, on a worker thread.
+    """
+    store: Optional[Tuple[Callable, Callable]] = None
+    loading: Optional[asyncio.Future] = None
+
+    def on_loaded(future: asyncio.Future):
+        nonlocal loading
+        if future.exception() is not None:  # Retry the load on the next call.
+            loading = None
+
+    async def get_store() -> Tuple[Callable, Callable]:
+        nonlocal store, loading
+        if store is None:
+            if loading is None:
+                loading = asyncio.get_running_loop().run_in_executor(
+                    None,
+                    functools.partial(
+                        make_store,
+                        cache_path,
+                        name,
+                        sync_threshold,
+                        **gamla.merge(kwargs, {"write_behind": True}),
+                    ),
                 )
+                loading.add_done_callback(on_loaded)
+            store = await asyncio.shield(loading)
+        return store
 
-    return get_item, set_item
+    async def get_item(key: str):
+        return (await get_store())[0](key)
 
+    async def set_item(key: str, value):
+        (await get_store())[1](key, value)
 
-make_async_store = gamla.compose_left(
-    make_store,
-    gamla.map(gamla.wrap_awaitable),
-    tuple,
-)
+    return get_item, set_item
@@ -1,3 +1,9 @@
+import asyncio
+import threading
+import time
+
+import pytest
+
 from cloud_utils.cache.stores import pickle
 
 
@@ -39,3 +45,144 @@ def test_pickle_store_sync_threshold_one_persists_every_write(pickle_file):
     get_item, _ = pickle.make_store(pickle_file, "test-store", 1)
     for x in range(3):
         assert get_item(f"{x}") == x
+
+
+def test_pickle_store_appends_changes_and_compacts(tmp_path):
+    _, set_item = pickle.make_store(tmp_path, "log-store", 1)
+    set_item("1", 1)
+    set_item("2", 2)
+    assert (tmp_path / "log-store.pickle.log").stat().st_size > 0
+
+    # Rewriting an existing key grows the log past the cache size, which compacts it.
+    set_item("1", 10)
+    assert (tmp_path / "log-store.pickle").exists()
+    assert (tmp_path / "log-store.pickle.log").stat().st_size == 0
+
+    set_item("2", 20)
+    set_item("3", 3)
+    get_item, _ = pickle.make_store(tmp_path, "log-store", 1)
+    assert get_item("1") == 10
+    assert get_item("2") == 20
+    assert get_item("3") == 3
+
+
+def test_pickle_store_truncates_partial_log_entry(tmp_path):
+    _, set_item = pickle.make_store(tmp_path, "crash-store", 1)
+    set_item("1", 1)
+    with open(tmp_path / "crash-store.pickle.log", "ab") as log_file:
+        log_file.write(b"\x80\x04\x95")
+
+    get_item, set_item = pickle.make_store(tmp_path, "crash-store", 1)
+    assert get_item("1") == 1
+    set_item("2", 2)
+
+    get_item, _ = pickle.make_store(tmp_path, "crash-store", 1)
+    assert get_item("1") == 1
+    assert get_item("2") == 2
+
+
+def test_pickle_store_crash_before_log_is_emptied(tmp_path, monkeypatch):
+    _, set_item = pickle.make_store(tmp_path, "compact-store", 1)
+    set_item("k", 1)  # Logged.
+    replace = pickle.os.replace
+
+    def crash_after_replace(*args):
+        replace(*args)
+        raise OSError("crashed")
+
+    monkeypatch.setattr(pickle.os, "replace", crash_after_replace)
+    set_item("k", 2)  # Compacted, the process crashes before emptying the log.
+    monkeypatch.undo()
+
+    get_item, _ = pickle.make_store(tmp_path, "compact-store", 1)
+    assert get_item("k") == 2
+
+
+def test_pickle_store_write_behind(tmp_path):
+    synced = threading.Event()
+    durations = []
+
+    def on_sync_duration(duration):
+        durations.append(duration)
+        synced.set()
+
+    get_item, set_item = pickle.make_store(
+        tmp_path,
+        "write-behind-store",
+        2,
+        write_behind=True,
+        on_sync_duration=on_sync_duration,
+    )
+    set_item("1", 1)
+    set_item("2", 2)
+    assert get_item("2") == 2
+
+    assert synced.wait(timeout=5)
+    assert durations[0] >= 0
+    get_item, _ = pickle.make_store(tmp_path, "write-behind-store", 2)
+    assert get_item("1") == 1
+    assert get_item("2") == 2
+
+
+def test_pickle_store_write_behind_syncs_on_exit(tmp_path, monkeypatch):
+    exit_hooks = []
+    monkeypatch.setattr(pickle.atexit, "register", exit_hooks.append)
+    dumps = pickle.pickle.dumps
+
+    def slow_dumps(*args, **kwargs):
+        time.sleep(0.1)
+        return dumps(*args, **kwargs)
+
+    synced = threading.Event()
+    _, set_item = pickle.make_store(
+        tmp_path,
+        "exit-store",
+        1,
+        write_behind=True,
+        on_sync_duration=lambda _: synced.set(),
+    )
+    set_item("1", 1)
+    assert synced.wait(timeout=5)
+    monkeypatch.setattr(pickle.pickle, "dumps", slow_dumps)
+    set_item("2", 2)  # Starts a slow background sync.
+    time.sleep(0.02)  # Let it take the change.
+    for exit_hook in exit_hooks:
+        exit_hook()
+
+    get_item, _ = pickle.make_store(tmp_path, "exit-store", 1)
+    assert get_item("2") == 2
+
+
+async def test_pickle_store_async_loads_once_off_the_event_loop(tmp_path, monkeypatch):
+    loading_threads = []
+    make_store = pickle.make_store
+
+    def recording_make_store(*args, **kwargs):
+        loading_threads.append(threading.current_thread())
+        return make_store(*args, **kwargs)
+
+    monkeypatch.setattr(pickle, "make_store", recording_make_store)
+    get_item, set_item = pickle.make_async_store(tmp_path, "async-store", 50)
+
+    await asyncio.gather(*(set_item(f"{x}", x) for x in range(10)))
+    assert await get_item("9") == 9
+    assert len(loading_threads) == 1
+    assert loading_threads[0] is not threading.main_thread()
+
+
+async def test_pickle_store_async_retries_a_failed_load(tmp_path, monkeypatch):
+    make_store = pickle.make_store
+    failures = [OSError("disk unavailable")]
+
+    def failing_make_store(*args, **kwargs):
+        if failures:
+            raise failures.pop()
+        return make_store(*args, **kwargs)
+
+    monkeypatch.setattr(pickle, "make_store", failing_make_store)
+    get_item, set_item = pickle.make_async_store(tmp_path, "retry-store", 50)
+
+    with pytest.raises(OSError):
+        await set_item("1", 1)
+    await set_item("1", 1)
+    assert await get_item("1") == 1
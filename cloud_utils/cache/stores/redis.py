@@ -1,10 +1,22 @@
+import asyncio
 import logging
-from typing import Any, Callable, Tuple
+import secrets
+import time
+from typing import Any, Awaitable, Callable, Dict, Iterable, List, Optional, Set, Tuple
 
+import cachetools
 import gamla
 import redis.asyncio as redis
 
 from cloud_utils.cache import utils
+from cloud_utils.cache.stores import (
+    circuit_breaker,
+    consistent_hash,
+    limiter,
+    near_cache,
+    negative,
+    xfetch,
+)
 
 
 def redis_error_handler(f):
@@ -12,6 +24,8 @@ def redis_error_handler(f):
         try:
             result = await f(*args, **kwargs)
             return result
+        except circuit_breaker.CircuitOpenError as err:  # Failing fast, already logged.
+            logging.debug(f"redis: {str(err)}")
         except (
             redis.ConnectionError,
             redis.TimeoutError,
@@ -21,16 +35,10 @@ def redis_error_handler(f):
     return wrapper
 
 
-def make_store_with_custom_ttl(
+def _make_lazy_client(
     make_redis_client: Callable[[], redis.Redis],
-    max_parallelism: int,
-    ttl: Callable[[Any], int],
-    name: str,
-    encoder: Callable[[Any], Any],
-    decoder: Callable[[Any], Any],
-) -> Tuple[Callable, Callable]:
+) -> Callable[[], redis.Redis]:
     redis_client = None
-    utils.log_initialized_cache("redis", name)
 
     def get_redis_client():
         nonlocal redis_client
@@ -39,40 +47,252 @@ def make_store_with_custom_ttl(
 
         return redis_client
 
-    async def get_item(key: str):
-        cache_key = utils.cache_key_name(name, key)
-        result = await redis_error_handler(get_redis_client().get)(cache_key)
-        if result is None:
-            logging.debug(f"{key} is not in {name}")
-            raise KeyError
+    return get_redis_client
+
+
+def _decode(decoder: Callable[[Any], Any], name: str, key: str, result):
+    if result is None:
+        logging.debug(f"{key} is not in {name}")
+        raise KeyError
+    try:
+        return decoder(result)
+    except ValueError:  # Key contents are malformed (will force key to update).
+        logging.error(f"Malformed key detected: {key} in {name}.")
+        raise KeyError
+
+
+def _make_throttle(
+    max_parallelism: int,
+    throttle: Optional[Callable[[str, Callable], Callable]],
+) -> Optional[Callable[[str, Callable], Callable]]:
+    # When using a redis async client, we are limited to the amount of connections we can create.
+    # Usually the cached function `f` will be throttled, meaning we can exhaust all connections on `get` operations (`get` happens before `f`).
+    # The limiter prefers `get` operations, but guarantees `set` operations a share of the connections when both are waiting.
+    if throttle is None and max_parallelism > 0:
+        return limiter.make_limiter(max_parallelism)
+    return throttle
+
+
+def _throttle_get_set(
+    max_parallelism: int,
+    throttle: Optional[Callable[[str, Callable], Callable]],
+    get_item: Callable,
+    set_item: Callable,
+):
+    throttle = _make_throttle(max_parallelism, throttle)
+    if throttle is None:
+        return get_item, set_item
+    return throttle(limiter.GET, get_item), throttle(limiter.SET, set_item)
+
+
+def _lock_on_miss(
+    get_redis_client: Callable[[], redis.Redis],
+    guard: Callable[[Callable], Callable],
+    throttle: Optional[Callable[[str, Callable], Callable]],
+    name: str,
+    lock_lease: float,
+    lock_poll_interval: float,
+    get_item: Callable,
+    set_item: Callable,
+) -> Tuple[Callable, Callable]:
+    # On a miss, the first caller across all processes takes a lease (`SET NX PX` of a random token) and gets the miss, to compute the value.
+    # The others poll until the value is set, and get the miss themselves only if the lease expires first (e.g. the holder crashed).
+    # The lease is released only while it still holds our token, so a late holder never releases a lease another caller took since.
+    tokens: cachetools.TTLCache = cachetools.TTLCache(maxsize=10_000, ttl=lock_lease)
+
+    def lock_key(key: str) -> str:
+        return f"{utils.cache_key_name(name, key)}:lock"
+
+    async def try_lock(key: str) -> bool:
+        token = secrets.token_hex(16)
         try:
-            return decoder(result)
-        except ValueError:  # Key contents are malformed (will force key to update).
-            logging.error(f"Malformed key detected: {key} in {name}.")
-            raise KeyError
+            locked = await guard(get_redis_client().set)(
+                lock_key(key),
+                token,
+                nx=True,
+                px=int(lock_lease * 1000),
+            )
+        except (redis.ConnectionError, redis.TimeoutError) as err:
+            logging.debug(f"redis: could not lock {key} in {name}: {str(err)}")
+            return True
+        if locked:
+            tokens[key] = token
+        return bool(locked)
 
-    async def set_item(key: str, value):
+    async def unlock(key: str, token: str):
+        async with get_redis_client().pipeline() as pipeline:
+            try:
+                await pipeline.watch(lock_key(key))
+                if await pipeline.get(lock_key(key)) not in (token, token.encode()):
+                    return
+                pipeline.multi()
+                pipeline.delete(lock_key(key))
+                await pipeline.execute()
+            except redis.WatchError:
+                # The lease expired and was taken while releasing it.
+                logging.debug(f"Lock on {key} in {name} was taken by another caller.")
+
+    lock, release = (
+        (try_lock, guard(unlock))
+        if throttle is None
+        else (throttle(limiter.GET, try_lock), throttle(limiter.SET, guard(unlock)))
+    )
+
+    async def locked_get_item(key: str):
+        try:
+            return await get_item(key)
+        except KeyError:
+            if await lock(key):
+                raise
+        deadline = time.monotonic() + lock_lease
+        while time.monotonic() < deadline:
+            await asyncio.sleep(lock_poll_interval)
+            try:
+                return await get_item(key)
+            except KeyError:
+                pass
+        logging.debug(f"Lock on {key} in {name} expired, computing it.")
+        raise KeyError
+
+    async def unlocking_set_item(key: str, value):
+        await set_item(key, value)
+        token = tokens.pop(key, None)
+        if token is not None:
+            await redis_error_handler(release)(key, token)
+
+    return locked_get_item, unlocking_set_item
+
+
+def make_store_with_custom_ttl(
+    make_redis_client: Callable[[], redis.Redis],
+    max_parallelism: int,
+    ttl: Callable[[Any], int],
+    name: str,
+    encoder: Callable[[Any], Any],
+    decoder: Callable[[Any], Any],
+    near_cache_size: int = 0,
+    throttle: Optional[Callable[[str, Callable], Callable]] = None,
+    guard: Callable[[Callable], Callable] = gamla.identity,
+    xfetch_beta: float = 0,
+    refresh: Optional[Callable[[str], Awaitable[Any]]] = None,
+    negative_ttl: float = 0,
+    lock_lease: float = 0,
+    lock_poll_interval: float = 0.05,
+) -> Tuple[Callable, Callable]:
+    """Operations are limited to `max_parallelism` concurrent calls, or by `throttle` (see `limiter.make_limiter`) if given.
+
+    Redis calls are wrapped with `guard`, e.g. `circuit_breaker.make_circuit_breaker` to fail fast while redis is down.
+
+    With `near_cache_size`, up to that many values are also kept locally until another writer updates them (see `near_cache`).
+
+    With `xfetch_beta`, values are stored with their compute time (the time from a miss to the `set_item` of the key) and expiry,
+    and reads refresh them early with a probability growing towards expiry (see `xfetch`). If `refresh(key)` is given, it is
+    run in the background and its result is stored, while the current value is returned. Otherwise the read is a miss, so
+    that caller recomputes the value. Keys stored without `xfetch_beta` read as malformed in this mode, and vice versa.
+
+    With `negative_ttl`, `negative.ABSENT` values are stored as negative entries which expire after that many seconds.
+
+    With `lock_lease` (seconds), concurrent misses of a key in all processes are collapsed: the first takes a lease on the key and
+    gets the miss, and the others poll redis every `lock_poll_interval` seconds for the value it sets. If the lease expires first
+    (e.g. the value took too long or its process crashed), they get the miss too. Set it to about the time to compute a value.
+    """
+    value_ttl = negative.absent_ttl(ttl, negative_ttl) if negative_ttl else ttl
+    if negative_ttl:
+        ttl = negative.ttl(ttl, negative_ttl)
+        encoder = negative.encoder(encoder)
+        decoder = negative.decoder(decoder)
+    get_redis_client = _make_lazy_client(make_redis_client)
+    utils.log_initialized_cache("redis", name)
+    miss_times: cachetools.LRUCache = cachetools.LRUCache(maxsize=10_000)
+    refreshing: Set[str] = set()
+    refresh_tasks: Set[asyncio.Task] = set()
+
+    async def write(key: str, value, delta: float):
         ttl_value = ttl(value)
         value = encoder(value)
+        if xfetch_beta:
+            value = xfetch.encode(
+                delta,
+                time.time() + ttl_value if ttl_value else 0,
+                value,
+            )
         if ttl_value == 0:
             await redis_error_handler(
-                get_redis_client().set,
+                guard(get_redis_client().set),
             )(utils.cache_key_name(name, key), value)
         else:
-            await redis_error_handler(get_redis_client().setex)(
+            await redis_error_handler(guard(get_redis_client().setex))(
                 utils.cache_key_name(name, key),
                 ttl_value,
                 value,
             )
 
-    # When using a redis async client, we are limited to the amount of connections we can create.
-    # Usually the cached function `f` will be throttled, meaning we can exhaust all connections on `get` operations (`get` happens before `f`).
-    # In order to allow `set` operations to also occur in parallel we split the get/set operations proportionally to `max_parallelism`.
-    if max_parallelism > 0:
-        allowed_get_operations = round(0.8 * max_parallelism)
-        get_item = gamla.throttle(allowed_get_operations, get_item)
-        set_item = gamla.throttle(max_parallelism - allowed_get_operations, set_item)
+    async def refresh_in_background(key: str):
+        miss_times[key] = time.monotonic()
+        try:
+            value = await refresh(key)
+            # The `set_item` this returns, so the write is throttled, converted to a negative entry and invalidates near caches.
+            await set_item(key, value)
+        except Exception as err:
+            # The current value is still served, retry on a later read.
+            logging.error(f"Could not refresh {key} in {name}: {err}")
+        finally:
+            refreshing.discard(key)
 
+    def refresh_early(key: str):
+        if refresh is None:
+            logging.debug(f"Refreshing {key} in {name} early.")
+            miss_times[key] = time.monotonic()
+            raise KeyError
+        if key in refreshing:
+            return
+        refreshing.add(key)
+        task = asyncio.create_task(refresh_in_background(key))
+        refresh_tasks.add(task)
+        task.add_done_callback(refresh_tasks.discard)
+
+    async def get_item(key: str):
+        cache_key = utils.cache_key_name(name, key)
+        result = await redis_error_handler(guard(get_redis_client().get))(cache_key)
+        if not xfetch_beta:
+            return _decode(decoder, name, key, result)
+        try:
+            delta, expiry, value = _decode(xfetch.decode(decoder), name, key, result)
+        except KeyError:
+            miss_times[key] = time.monotonic()
+            raise
+        if xfetch.should_refresh(delta, expiry, xfetch_beta):
+            refresh_early(key)
+        return value
+
+    async def set_item(key: str, value):
+        now = time.monotonic()
+        await write(key, value, now - miss_times.pop(key, now))
+
+    throttle = _make_throttle(max_parallelism, throttle)
+    get_item, set_item = _throttle_get_set(0, throttle, get_item, set_item)
+    if lock_lease:
+        get_item, set_item = _lock_on_miss(
+            get_redis_client,
+            guard,
+            throttle,
+            name,
+            lock_lease,
+            lock_poll_interval,
+            get_item,
+            set_item,
+        )
+    if negative_ttl:
+        get_item, set_item = negative.make_async_store(get_item, set_item, negative_ttl)
+    if near_cache_size > 0:
+        get_item, set_item = near_cache.make_async_store(
+            make_redis_client,
+            near_cache_size,
+            name,
+            get_item,
+            set_item,
+            value_ttl,
+        )
     return get_item, set_item
 
 
@@ -83,6 +303,14 @@ def make_store(
     name: str,
     encoder: Callable[[Any], Any],
     decoder: Callable[[Any], Any],
+    near_cache_size: int = 0,
+    throttle: Optional[Callable[[str, Callable], Callable]] = None,
+    guard: Callable[[Callable], Callable] = gamla.identity,
+    xfetch_beta: float = 0,
+    refresh: Optional[Callable[[str], Awaitable[Any]]] = None,
+    negative_ttl: float = 0,
+    lock_lease: float = 0,
+    lock_poll_interval: float = 0.05,
 ) -> Tuple[Callable, Callable]:
     return make_store_with_custom_ttl(
         make_redis_client,
@@ -91,4 +319,233 @@ def make_store(
         name,
         encoder,
         decoder,
+        near_cache_size,
+        throttle,
+        guard,
+        xfetch_beta,
+        refresh,
+        negative_ttl,
+        lock_lease,
+        lock_poll_interval,
+    )
+
+
+def make_batch_store_with_custom_ttl(
+    make_redis_client: Callable[[], redis.Redis],
+    max_parallelism: int,
+    ttl: Callable[[Any], int],
+    name: str,
+    encoder: Callable[[Any], Any],
+    decoder: Callable[[Any], Any],
+    throttle: Optional[Callable[[str, Callable], Callable]] = None,
+    guard: Callable[[Callable], Callable] = gamla.identity,
+) -> Tuple[Callable, Callable]:
+    """Same as `make_store_with_custom_ttl`, but returns `(get_many, set_many)`.
+
+    `get_many` takes an iterable of keys and returns a dict of the keys found (missing and malformed keys are omitted) using a single `MGET`.
+    `set_many` takes a dict of key to value and writes it in a single pipeline, with a `SET`/`SETEX` per key according to `ttl(value)`.
+    """
+    get_redis_client = _make_lazy_client(make_redis_client)
+    utils.log_initialized_cache("redis", name)
+
+    async def get_many(keys: Iterable[str]) -> Dict[str, Any]:
+        keys = tuple(keys)
+        if not keys:
+            return {}
+        results = await redis_error_handler(guard(get_redis_client().mget))(
+            [utils.cache_key_name(name, key) for key in keys],
+        )
+        found = {}
+        for key, result in zip(keys, results or [None] * len(keys)):
+            try:
+                found[key] = _decode(decoder, name, key, result)
+            except KeyError:
+                pass
+        return found
+
+    async def set_many(items: Dict[str, Any]):
+        if not items:
+            return
+        pipeline = get_redis_client().pipeline(transaction=False)
+        for key, value in items.items():
+            ttl_value = ttl(value)
+            if ttl_value == 0:
+                pipeline.set(utils.cache_key_name(name, key), encoder(value))
+            else:
+                pipeline.setex(
+                    utils.cache_key_name(name, key),
+                    ttl_value,
+                    encoder(value),
+                )
+        await redis_error_handler(guard(pipeline.execute))()
+
+    return _throttle_get_set(max_parallelism, throttle, get_many, set_many)
+
+
+def make_batch_store(
+    make_redis_client: Callable[[], redis.Redis],
+    max_parallelism: int,
+    ttl: int,
+    name: str,
+    encoder: Callable[[Any], Any],
+    decoder: Callable[[Any], Any],
+    throttle: Optional[Callable[[str, Callable], Callable]] = None,
+    guard: Callable[[Callable], Callable] = gamla.identity,
+) -> Tuple[Callable, Callable]:
+    return make_batch_store_with_custom_ttl(
+        make_redis_client,
+        max_parallelism,
+        gamla.just(ttl),
+        name,
+        encoder,
+        decoder,
+        throttle,
+        guard,
+    )
+
+
+def _group_by_shard(
+    shard_for: Callable[[str], str],
+    name: str,
+    keys: Iterable[str],
+) -> Dict[str, List[str]]:
+    groups: Dict[str, List[str]] = {}
+    for key in keys:
+        groups.setdefault(shard_for(utils.cache_key_name(name, key)), []).append(key)
+    return groups
+
+
+def make_sharded_store_with_custom_ttl(
+    make_redis_clients: Dict[str, Callable[[], redis.Redis]],
+    max_parallelism: int,
+    ttl: Callable[[Any], int],
+    name: str,
+    encoder: Callable[[Any], Any],
+    decoder: Callable[[Any], Any],
+    **kwargs,
+) -> Tuple[Callable, Callable]:
+    """Same as `make_store_with_custom_ttl`, but spreads keys over several redis servers.
+
+    `make_redis_clients` maps a stable shard name (e.g. the server's host) to its client factory.
+    Keys are assigned to shards by consistent hashing of their cache key (see `consistent_hash`), so adding
+    or removing a shard remaps only the keys it gains or owned.
+    `max_parallelism` applies per shard. The other options are passed to each shard's store.
+    Redis Cluster is not supported: batch stores read many keys in one `MGET`, which fails across hash slots,
+    and near cache invalidation tracking needs a single server. Shard over standalone servers with these stores instead.
+    """
+    shard_for = consistent_hash.make_ring(make_redis_clients)
+    stores = {
+        shard: make_store_with_custom_ttl(
+            make_redis_client,
+            max_parallelism,
+            ttl,
+            name,
+            encoder,
+            decoder,
+            **kwargs,
+        )
+        for shard, make_redis_client in make_redis_clients.items()
+    }
+
+    async def get_item(key: str):
+        get_shard_item, _ = stores[shard_for(utils.cache_key_name(name, key))]
+        return await get_shard_item(key)
+
+    async def set_item(key: str, value):
+        _, set_shard_item = stores[shard_for(utils.cache_key_name(name, key))]
+        await set_shard_item(key, value)
+
+    return get_item, set_item
+
+
+def make_sharded_store(
+    make_redis_clients: Dict[str, Callable[[], redis.Redis]],
+    max_parallelism: int,
+    ttl: int,
+    name: str,
+    encoder: Callable[[Any], Any],
+    decoder: Callable[[Any], Any],
+    **kwargs,
+) -> Tuple[Callable, Callable]:
+    return make_sharded_store_with_custom_ttl(
+        make_redis_clients,
+        max_parallelism,
+        gamla.just(ttl),
+        name,
+        encoder,
+        decoder,
+        **kwargs,
+    )
+
+
+def make_sharded_batch_store_with_custom_ttl(
+    make_redis_clients: Dict[str, Callable[[], redis.Redis]],
+    max_parallelism: int,
+    ttl: Callable[[Any], int],
+    name: str,
+    encoder: Callable[[Any], Any],
+    decoder: Callable[[Any], Any],
+    throttle: Optional[Callable[[str, Callable], Callable]] = None,
+    guard: Callable[[Callable], Callable] = gamla.identity,
+) -> Tuple[Callable, Callable]:
+    """Same as `make_batch_store_with_custom_ttl`, with keys sharded as in `make_sharded_store_with_custom_ttl`.
+
+    Keys are grouped per shard, with one `MGET` or pipeline per shard, and the shards are called concurrently.
+    """
+    shard_for = consistent_hash.make_ring(make_redis_clients)
+    stores = {
+        shard: make_batch_store_with_custom_ttl(
+            make_redis_client,
+            max_parallelism,
+            ttl,
+            name,
+            encoder,
+            decoder,
+            throttle,
+            guard,
+        )
+        for shard, make_redis_client in make_redis_clients.items()
+    }
+
+    async def get_many(keys: Iterable[str]) -> Dict[str, Any]:
+        found: Dict[str, Any] = {}
+        for shard_found in await asyncio.gather(
+            *(
+                stores[shard][0](shard_keys)
+                for shard, shard_keys in _group_by_shard(shard_for, name, keys).items()
+            ),
+        ):
+            found.update(shard_found)
+        return found
+
+    async def set_many(items: Dict[str, Any]):
+        await asyncio.gather(
+            *(
+                stores[shard][1]({key: items[key] for key in shard_keys})
+                for shard, shard_keys in _group_by_shard(shard_for, name, items).items()
+            ),
+        )
+
+    return get_many, set_many
+
+
+def make_sharded_batch_store(
+    make_redis_clients: Dict[str, Callable[[], redis.Redis]],
+    max_parallelism: int,
+    ttl: int,
+    name: str,
+    encoder: Callable[[Any], Any],
+    decoder: Callable[[Any], Any],
+    throttle: Optional[Callable[[str, Callable], Callable]] = None,
+    guard: Callable[[Callable], Callable] = gamla.identity,
+) -> Tuple[Callable, Callable]:
+    return make_sharded_batch_store_with_custom_ttl(
+        make_redis_clients,
+        max_parallelism,
+        gamla.just(ttl),
+        name,
+        encoder,
+        decoder,
+        throttle,
+        guard,
     )
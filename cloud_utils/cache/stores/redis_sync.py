@@ -1,9 +1,12 @@
 import logging
+import math
 from typing import Any, Callable, Tuple
 
+import gamla
 import redis
 
 from cloud_utils.cache import utils
+from cloud_utils.cache.stores import circuit_breaker, near_cache, negative
 
 
 def _redis_error_handler(f):
@@ -11,6 +14,8 @@ def _redis_error_handler(f):
         try:
             result = f(*args, **kwargs)
             return result
+        except circuit_breaker.CircuitOpenError as err:  # Failing fast, already logged.
+            logging.debug(f"Got {str(err)} error")
         except (
             redis.ConnectionError,
             redis.TimeoutError,
@@ -26,8 +31,20 @@ def make_store(
     name: str,
     encoder: Callable[[Any], Any],
     decoder: Callable[[Any], Any],
+    near_cache_size: int = 0,
+    guard: Callable[[Callable], Callable] = gamla.identity,
+    negative_ttl: float = 0,
 ) -> Tuple[Callable, Callable]:
+    """With `near_cache_size`, up to that many values are also kept locally until another writer updates them (see `near_cache`).
+
+    Redis calls are wrapped with `guard`, e.g. `circuit_breaker.make_circuit_breaker` to fail fast while redis is down.
+
+    With `negative_ttl`, `negative.ABSENT` values are stored as negative entries which expire after that many seconds.
+    """
     redis_client = None
+    if negative_ttl:
+        encoder = negative.encoder(encoder)
+        decoder = negative.decoder(decoder)
     utils.log_initialized_cache("redis", name)
 
     def get_redis_client():
@@ -39,7 +56,7 @@ def make_store(
 
     def get_item(key: str):
         cache_key = utils.cache_key_name(name, key)
-        result = _redis_error_handler(get_redis_client().get)(cache_key)
+        result = _redis_error_handler(guard(get_redis_client().get))(cache_key)
         if result is None:
             logging.debug(f"{key} is not in {name}")
             raise KeyError
@@ -50,17 +67,29 @@ def make_store(
             raise KeyError
 
     def set_item(key: str, value):
+        ttl_value = math.ceil(negative_ttl) if negative.is_negative(value) else ttl
         value = encoder(value)
-        if ttl == 0:
-            _redis_error_handler(get_redis_client().set)(
+        if ttl_value == 0:
+            _redis_error_handler(guard(get_redis_client().set))(
                 utils.cache_key_name(name, key),
                 value,
             )
         else:
-            _redis_error_handler(get_redis_client().setex)(
+            _redis_error_handler(guard(get_redis_client().setex))(
                 utils.cache_key_name(name, key),
-                ttl,
+                ttl_value,
                 value,
             )
 
+    if negative_ttl:
+        get_item, set_item = negative.make_store(get_item, set_item, negative_ttl)
+    if near_cache_size > 0:
+        return near_cache.make_store(
+            make_redis_client,
+            near_cache_size,
+            name,
+            get_item,
+            set_item,
+            negative.absent_ttl(gamla.just(ttl), negative_ttl),
+        )
     return get_item, set_item
@@ -1,12 +1,15 @@
 import asyncio
+import collections
+import functools
 import json
 from typing import Callable
 
 import gamla
+import pytest
 from fakeredis import FakeServer, FakeStrictRedis, aioredis
 
 from cloud_utils.cache import utils
-from cloud_utils.cache.stores import redis, redis_sync
+from cloud_utils.cache.stores import limiter, redis, redis_sync
 
 _SERVER = FakeServer()
 
@@ -124,3 +127,155 @@ def test_redis_sync_store_ttl():
             utils.cache_key_name("ttl_1", "1")
             not in _make_sync_fake_redis_client().keys()
         )
+
+
+async def test_redis_batch_store():
+    get_many, set_many = redis.make_batch_store_with_custom_ttl(
+        _make_async_fake_redis_client,
+        5,
+        _ttl_by_value,
+        "batch_store",
+        json.dumps,
+        json.loads,
+    )
+
+    await set_many({"1": "one", "2": 2, "3": [3]})
+    await _make_async_fake_redis_client().set(
+        utils.cache_key_name("batch_store", "malformed"),
+        "{",
+    )
+
+    assert await get_many(["1", "2", "3", "missing", "malformed"]) == {
+        "1": "one",
+        "2": 2,
+        "3": [3],
+    }
+    assert await get_many([]) == {}
+
+
+async def test_redis_batch_store_shares_keys_with_single_key_store():
+    get_item, set_item = redis.make_store(
+        _make_async_fake_redis_client,
+        0,
+        0,
+        "shared_store",
+        json.dumps,
+        json.loads,
+    )
+    get_many, set_many = redis.make_batch_store(
+        _make_async_fake_redis_client,
+        0,
+        0,
+        "shared_store",
+        json.dumps,
+        json.loads,
+    )
+
+    await set_item("1", 1)
+    await set_many({"2": 2})
+
+    assert await get_many(["1"]) == {"1": 1}
+    assert await get_item("2") == 2
+
+
+async def test_redis_sharded_stores_spread_keys_over_shards():
+    servers = {shard: FakeServer() for shard in ("a", "b", "c")}
+    make_redis_clients = {
+        shard: functools.partial(aioredis.FakeRedis, server=server)
+        for shard, server in servers.items()
+    }
+    get_item, set_item = redis.make_sharded_store(
+        make_redis_clients,
+        0,
+        0,
+        "sharded_store",
+        json.dumps,
+        json.loads,
+    )
+    get_many, set_many = redis.make_sharded_batch_store(
+        make_redis_clients,
+        0,
+        0,
+        "sharded_store",
+        json.dumps,
+        json.loads,
+    )
+
+    await set_many({str(i): i for i in range(30)})
+    await set_item("30", 30)
+
+    assert await get_many(map(str, range(32))) == {str(i): i for i in range(31)}
+    assert await get_item("30") == 30
+    for server in servers.values():
+        assert 0 < len(FakeStrictRedis(server=server).keys()) < 31
+
+
+def _make_locking_store(lock_lease: float, **kwargs):
+    return redis.make_store(
+        _make_async_fake_redis_client,
+        0,
+        0,
+        "locking_store",
+        json.dumps,
+        json.loads,
+        lock_lease=lock_lease,
+        lock_poll_interval=0.01,
+        **kwargs,
+    )
+
+
+async def test_redis_store_lock_lets_one_process_compute_a_miss():
+    get_item, set_item = _make_locking_store(1)
+    other_get_item, _ = _make_locking_store(1)
+
+    with pytest.raises(KeyError):
+        await get_item("1")
+    waiting = asyncio.create_task(other_get_item("1"))
+    await asyncio.sleep(0.05)
+    assert not waiting.done()
+    await set_item("1", 1)
+
+    assert await waiting == 1
+
+
+async def test_redis_store_lock_expires():
+    get_item, _ = _make_locking_store(0.1)
+    other_get_item, _ = _make_locking_store(0.1)
+
+    with pytest.raises(KeyError):
+        await get_item("2")
+    with pytest.raises(KeyError):
+        await other_get_item("2")
+
+
+async def test_redis_store_lock_not_released_after_it_expired():
+    get_item, set_item = _make_locking_store(0.1)
+    other_get_item, _ = _make_locking_store(0.1)
+
+    with pytest.raises(KeyError):
+        await get_item("3")
+    await asyncio.sleep(0.15)
+    with pytest.raises(KeyError):
+        await other_get_item("3")
+    await set_item("3", 3)
+
+    assert await _make_async_fake_redis_client().exists("locking_store:3:lock")
+
+
+async def test_redis_store_lock_is_throttled():
+    calls: collections.Counter = collections.Counter()
+
+    def throttle(kind, f):
+        async def throttled(*args):
+            calls[kind] += 1
+            return await f(*args)
+
+        return throttled
+
+    get_item, set_item = _make_locking_store(1, throttle=throttle)
+
+    with pytest.raises(KeyError):
+        await get_item("4")
+    await set_item("4", 4)
+
+    assert calls == {limiter.GET: 2, limiter.SET: 2}
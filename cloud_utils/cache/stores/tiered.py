@@ -0,0 +1,48 @@
+import collections
+import logging
+from typing import Callable, Optional, Tuple
+
+from cloud_utils.cache import utils
+from cloud_utils.cache.stores import lru_memory
+
+
+def make_async_store(
+    l2_store: Tuple[Callable, Callable],
+    l1_max_size: int,
+    l1_ttl: float,
+    name: str,
+    stats: Optional[collections.Counter] = None,
+) -> Tuple[Callable, Callable]:
+    """A read-through store with a bounded in-process LRU (L1) in front of an async store (L2), e.g. `redis.make_store`.
+
+    L1 entries expire after `l1_ttl` seconds, L2 hits are promoted into L1.
+    If `stats` is given, `l1_hit`, `l1_miss`, `l2_hit` and `l2_miss` are counted in it.
+    """
+    utils.log_initialized_cache("tiered", name)
+    l2_get_item, l2_set_item = l2_store
+    l1_get_item, l1_set_item = lru_memory.make_store(l1_max_size, name, ttl=l1_ttl)
+    if stats is None:
+        stats = collections.Counter()
+
+    async def get_item(key: str):
+        try:
+            value = l1_get_item(key)
+            stats["l1_hit"] += 1
+            return value
+        except KeyError:
+            stats["l1_miss"] += 1
+        try:
+            value = await l2_get_item(key)
+        except KeyError:
+            stats["l2_miss"] += 1
+            logging.debug(f"{key} is not in {name}")
+            raise
+        stats["l2_hit"] += 1
+        l1_set_item(key, value)
+        return value
+
+    async def set_item(key: str, value):
+        await l2_set_item(key, value)
+        l1_set_item(key, value)
+
+    return get_item, set_item
@@ -0,0 +1,56 @@
+import asyncio
+import collections
+import json
+
+import pytest
+from fakeredis import aioredis
+
+from cloud_utils.cache.stores import redis, tiered
+
+
+def _make_redis_store(name: str):
+    return redis.make_store(
+        aioredis.FakeRedis,
+        0,
+        0,
+        name,
+        json.dumps,
+        json.loads,
+    )
+
+
+async def test_tiered_store_promotes_l2_hits():
+    stats: collections.Counter = collections.Counter()
+    l2_get_item, l2_set_item = _make_redis_store("tiered")
+    get_item, _ = tiered.make_async_store(
+        (l2_get_item, l2_set_item),
+        10,
+        60,
+        "tiered",
+        stats,
+    )
+
+    await l2_set_item("1", 1)
+
+    assert await get_item("1") == 1
+    assert await get_item("1") == 1
+    with pytest.raises(KeyError):
+        await get_item("2")
+    assert stats == {"l1_hit": 1, "l1_miss": 2, "l2_hit": 1, "l2_miss": 1}
+
+
+async def test_tiered_store_l1_ttl():
+    stats: collections.Counter = collections.Counter()
+    get_item, set_item = tiered.make_async_store(
+        _make_redis_store("tiered_ttl"),
+        10,
+        0.05,
+        "tiered_ttl",
+        stats,
+    )
+
+    await set_item("1", 1)
+    assert await get_item("1") == 1
+    await asyncio.sleep(0.1)
+    assert await get_item("1") == 1
+    assert stats == {"l1_hit": 1, "l1_miss": 1, "l2_hit": 1}
@@ -0,0 +1,115 @@
+import asyncio
+import collections
+import itertools
+import json
+import logging
+from typing import Any, Callable, Dict, Iterable, List, Tuple
+
+from cloud_utils import storage
+
+
+def make_batch_store(
+    get_item: Callable,
+    set_item: Callable,
+) -> Tuple[Callable, Callable]:
+    """Returns `(get_many, set_many)` for an async store without a batch api (the redis stores have `make_batch_store`)."""
+
+    async def get_many(keys: Iterable[str]) -> Dict[str, Any]:
+        keys = tuple(keys)
+        found = {}
+        for key, result in zip(
+            keys,
+            await asyncio.gather(
+                *map(get_item, keys),
+                return_exceptions=True,
+            ),
+        ):
+            if isinstance(result, KeyError):
+                continue
+            if isinstance(result, BaseException):
+                raise result
+            found[key] = result
+        return found
+
+    async def set_many(items: Dict[str, Any]):
+        await asyncio.gather(*itertools.starmap(set_item, items.items()))
+
+    return get_many, set_many
+
+
+def track_hot_keys(
+    get_item: Callable,
+    set_item: Callable,
+    hits: collections.Counter,
+    max_keys: int = 10_000,
+) -> Tuple[Callable, Callable]:
+    """Counts the hits of each key of an async store in `hits`, for `export_hottest`.
+
+    Only about the `max_keys` most hit keys are kept, the rest are dropped when `hits` grows to twice that.
+    """
+
+    async def tracked_get_item(key: str):
+        value = await get_item(key)
+        hits[key] += 1
+        if len(hits) > 2 * max_keys:
+            hottest = hits.most_common(max_keys)
+            hits.clear()
+            hits.update(dict(hottest))
+        return value
+
+    return tracked_get_item, set_item
+
+
+async def preload(
+    set_many: Callable,
+    items: Iterable[Tuple[str, Any]],
+    batch_size: int = 500,
+) -> int:
+    """Writes `items` with `set_many` in batches of `batch_size`, consuming them lazily. Returns the number of items written."""
+    count = 0
+    iterator = iter(items)
+    while batch := dict(itertools.islice(iterator, batch_size)):
+        await set_many(batch)
+        count += len(batch)
+    return count
+
+
+async def export_hottest(
+    get_many: Callable,
+    hits: collections.Counter,
+    n: int,
+) -> List[Tuple[str, Any]]:
+    """Returns `(key, value)` of the `n` most hit keys still in the store, hottest first."""
+    keys = [key for key, _ in hits.most_common(n)]
+    found = await get_many(keys)
+    return [(key, found[key]) for key in keys if key in found]
+
+
+async def preload_from_bucket(
+    set_many: Callable,
+    bucket_name: str,
+    blob_name: str,
+    batch_size: int = 500,
+) -> int:
+    """Preloads a store from a snapshot written by `export_to_bucket`."""
+    snapshot = await asyncio.to_thread(
+        storage.download_blob_as_string,
+        bucket_name,
+        blob_name,
+    )
+    count = await preload(set_many, map(tuple, json.loads(snapshot)), batch_size)
+    logging.info(f"Preloaded {count} items from {blob_name}.")
+    return count
+
+
+async def export_to_bucket(
+    get_many: Callable,
+    hits: collections.Counter,
+    n: int,
+    bucket_name: str,
+    blob_name: str,
+):
+    """Writes the `n` hottest items as a json snapshot for `preload_from_bucket`. Values must be json serializable."""
+    items = await export_hottest(get_many, hits, n)
+    await asyncio.to_thread(storage.upload_blob, bucket_name, blob_name, items)
+    logging.info(f"Exported {len(items)} items to {blob_name}.")
@@ -0,0 +1,63 @@
+import collections
+import json
+
+from fakeredis import FakeServer, aioredis
+
+from cloud_utils.cache.stores import lru_memory, redis, warmup
+
+_SERVER = FakeServer()
+
+
+async def test_preload_writes_in_batches():
+    batches = []
+
+    async def set_many(items):
+        batches.append(items)
+
+    count = await warmup.preload(set_many, ((str(i), i) for i in range(5)), 2)
+
+    assert count == 5
+    assert batches == [{"0": 0, "1": 1}, {"2": 2, "3": 3}, {"4": 4}]
+
+
+async def test_preload_redis_and_export_hottest():
+    get_many, set_many = redis.make_batch_store(
+        lambda: aioredis.FakeRedis(server=_SERVER),
+        0,
+        0,
+        "warmup_store",
+        json.dumps,
+        json.loads,
+    )
+    await warmup.preload(set_many, [("1", 1), ("2", 2), ("3", 3)])
+    hits: collections.Counter = collections.Counter()
+    get_item, _ = warmup.track_hot_keys(
+        *redis.make_store(
+            lambda: aioredis.FakeRedis(server=_SERVER),
+            0,
+            0,
+            "warmup_store",
+            json.dumps,
+            json.loads,
+        ),
+        hits,
+    )
+
+    for key in ("3", "3", "1", "3", "1", "2"):
+        await get_item(key)
+
+    assert await warmup.export_hottest(get_many, hits, 2) == [("3", 3), ("1", 1)]
+
+
+async def test_export_hottest_skips_evicted_keys():
+    get_item, set_item = lru_memory.make_async_store(1, "warmup_lru")
+    hits: collections.Counter = collections.Counter()
+    get_item, set_item = warmup.track_hot_keys(get_item, set_item, hits)
+    await set_item("1", 1)
+    await get_item("1")
+    await set_item("2", 2)
+    await get_item("2")
+
+    get_many, _ = warmup.make_batch_store(get_item, set_item)
+
+    assert await warmup.export_hottest(get_many, hits, 2) == [("2", 2)]
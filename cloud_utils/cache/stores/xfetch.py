@@ -0,0 +1,40 @@
+"""Probabilistic early expiration ("XFetch", Vattani et al., "Optimal Probabilistic Cache Stampede Prevention").
+
+Values are stored with how long they took to compute and when they expire. Each read decides to refresh early with a
+probability growing as expiry nears, scaled by the compute time, so recomputation is spread over time and pods
+instead of all of them missing the key at once.
+"""
+
+import math
+import random
+import time
+from typing import Callable, Tuple
+
+_SEPARATOR = b"|"
+
+
+def encode(delta: float, expiry: float, encoded_value) -> bytes:
+    if isinstance(encoded_value, str):
+        encoded_value = encoded_value.encode()
+    return b"%.6f|%.3f|" % (delta, expiry) + encoded_value
+
+
+def decode(decoder: Callable) -> Callable[[bytes], Tuple[float, float, object]]:
+    """Returns a decoder of `(delta, expiry, value)`. Malformed values raise `ValueError`."""
+
+    def decode(encoded: bytes):
+        try:
+            delta, expiry, encoded_value = encoded.split(_SEPARATOR, 2)
+        except TypeError as err:
+            # Not bytes, e.g. from a client with `decode_responses`.
+            raise ValueError(err)
+        return float(delta), float(expiry), decoder(encoded_value)
+
+    return decode
+
+
+def should_refresh(delta: float, expiry: float, beta: float) -> bool:
+    """`expiry` of 0 means the value never expires. A `beta` above 1 favors earlier refreshes."""
+    if not expiry:
+        return False
+    return time.time() - delta * beta * math.log(1 - random.random()) >= expiry
@@ -0,0 +1,122 @@
+import asyncio
+import json
+import time
+
+import pytest
+from fakeredis import FakeServer, aioredis
+
+from cloud_utils.cache.stores import limiter, redis, xfetch
+
+_SERVER = FakeServer()
+
+
+def _make_async_fake_redis_client():
+    return aioredis.FakeRedis(server=_SERVER)
+
+
+def test_should_refresh():
+    assert not xfetch.should_refresh(10, 0, 1)
+    assert not xfetch.should_refresh(0, time.time() + 60, 1)
+    assert xfetch.should_refresh(0, time.time() - 1, 1)
+    assert any(xfetch.should_refresh(60, time.time() + 1, 1) for _ in range(100))
+
+
+def test_envelope_round_trip():
+    decode = xfetch.decode(json.loads)
+    assert decode(xfetch.encode(0.5, 100, json.dumps([1]))) == (0.5, 100, [1])
+    with pytest.raises(ValueError):
+        decode(b"[1]")
+
+
+async def test_xfetch_early_refresh_is_a_miss_for_one_caller(monkeypatch):
+    get_item, set_item = redis.make_store(
+        _make_async_fake_redis_client,
+        0,
+        60,
+        "xfetch",
+        json.dumps,
+        json.loads,
+        xfetch_beta=1,
+    )
+
+    with pytest.raises(KeyError):
+        await get_item("1")
+    await set_item("1", 1)
+    assert await get_item("1") == 1
+
+    monkeypatch.setattr(xfetch, "should_refresh", lambda *_: True)
+    with pytest.raises(KeyError):
+        await get_item("1")
+
+
+async def test_xfetch_background_refresh(monkeypatch):
+    async def refresh(key):
+        return int(key) + 1
+
+    get_item, set_item = redis.make_store(
+        _make_async_fake_redis_client,
+        0,
+        60,
+        "xfetch_background",
+        json.dumps,
+        json.loads,
+        xfetch_beta=1,
+        refresh=refresh,
+    )
+    await set_item("1", 1)
+
+    monkeypatch.setattr(xfetch, "should_refresh", lambda *_: True)
+    assert await get_item("1") == 1
+    await asyncio.sleep(0.01)
+    monkeypatch.setattr(xfetch, "should_refresh", lambda *_: False)
+    assert await get_item("1") == 2
+
+
+async def test_xfetch_str_responses_are_a_miss():
+    get_item, set_item = redis.make_store(
+        lambda: aioredis.FakeRedis(server=_SERVER, decode_responses=True),
+        0,
+        60,
+        "xfetch_str",
+        json.dumps,
+        json.loads,
+        xfetch_beta=1,
+    )
+
+    await set_item("1", 1)
+    with pytest.raises(KeyError):
+        await get_item("1")
+
+
+async def test_xfetch_background_refresh_is_throttled(monkeypatch):
+    sets = []
+
+    def throttle(kind, f):
+        async def throttled(*args):
+            if kind == limiter.SET:
+                sets.append(args)
+            return await f(*args)
+
+        return throttled
+
+    async def refresh(key):
+        return int(key) + 1
+
+    get_item, set_item = redis.make_store(
+        _make_async_fake_redis_client,
+        0,
+        60,
+        "xfetch_throttled",
+        json.dumps,
+        json.loads,
+        throttle=throttle,
+        xfetch_beta=1,
+        refresh=refresh,
+    )
+    await set_item("1", 1)
+
+    monkeypatch.setattr(xfetch, "should_refresh", lambda *_: True)
+    assert await get_item("1") == 1
+    await asyncio.sleep(0.01)
+
+    assert sets == [("1", 1), ("1", 2)]
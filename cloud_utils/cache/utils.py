@@ -1,8 +1,16 @@
+import asyncio
+import contextlib
 import datetime
+import fcntl
+import functools
+import hashlib
 import json
 import logging
 import os
-from typing import Callable, Dict, Optional
+import tempfile
+import time
+import weakref
+from typing import Callable, Dict, Optional, Tuple
 
 import gamla
 
@@ -11,30 +19,112 @@ from cloud_utils.cache import file_store
 _RESULT_HASH_KEY = "result_hash"
 _LAST_RUN_TIMESTAMP = "last_run_timestamp"
 
+# Limits the background refreshes of all `auto_updating_cache`s in the process (in `stale_while_revalidate` mode).
+_MAX_BACKGROUND_REFRESHES = int(
+    os.getenv("AUTO_UPDATING_CACHE_MAX_BACKGROUND_REFRESHES", "2"),
+)
+# Semaphores are bound to the event loop they first wait in, so there is one per loop.
+_background_refreshes: (
+    "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, asyncio.Semaphore]"
+) = weakref.WeakKeyDictionary()
+
+
+def _background_refresh_limit() -> asyncio.Semaphore:
+    loop = asyncio.get_running_loop()
+    if loop not in _background_refreshes:
+        _background_refreshes[loop] = asyncio.Semaphore(_MAX_BACKGROUND_REFRESHES)
+    return _background_refreshes[loop]
+
 
 class VersionNotFoundError(Exception):
     pass
 
 
+# Parsed versions files by path, with the (inode, size, mtime) they were read at.
+_versions_index: Dict[str, Tuple[Tuple[int, int, int], Dict]] = {}
+
+
+def _file_signature(path: str) -> Tuple[int, int, int]:
+    stat = os.stat(path)
+    return stat.st_ino, stat.st_size, stat.st_mtime_ns
+
+
+def _read_versions(cache_file_name: str) -> Dict:
+    """Returns the parsed versions file, read again only if it changed on disk. Do not mutate the result."""
+    signature = _file_signature(cache_file_name)
+    cached = _versions_index.get(cache_file_name)
+    if cached is not None and cached[0] == signature:
+        return cached[1]
+    with open(cache_file_name) as f:
+        versions = json.load(f)
+    _versions_index[cache_file_name] = (signature, versions)
+    return versions
+
+
+def _lock_path(*parts: str) -> str:
+    # Lock files are kept in the temp dir rather than next to the versions file, which is usually in the source tree.
+    digest = hashlib.blake2b("\0".join(parts).encode(), digest_size=8).hexdigest()
+    return os.path.join(tempfile.gettempdir(), f"cloud_utils_{digest}.lock")
+
+
+def refresh_lock_path(cache_file_path: str, identifier: str) -> str:
+    """The lock file held by the process refreshing `identifier` of the `auto_updating_cache` with `cache_file_path`."""
+    return _lock_path(os.path.abspath(cache_file_path), identifier)
+
+
+@contextlib.contextmanager
+def _file_lock(path: str):
+    with open(path, "ab") as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+@contextlib.asynccontextmanager
+async def _async_file_lock(path: str, poll_interval: float = 0.1):
+    # Polls a non blocking `flock`, so waiting does not block the event loop.
+    with open(path, "ab") as lock_file:
+        while True:
+            try:
+                fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                break
+            except BlockingIOError:
+                await asyncio.sleep(poll_interval)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
 @gamla.curry
 def _write_to_cache_file(
     cache_file_name: str,
     identifier: str,
     hash_dict: Dict,
 ):
-    cache_file = file_store.open_file("r+")(cache_file_name)
-    new_versions_dict = gamla.pipe(
-        cache_file,
-        json.load,
-        gamla.add_key_value(identifier, hash_dict),
-        dict.items,
-        sorted,
-        dict,
-    )
-    cache_file.seek(0)
-    json.dump(new_versions_dict, cache_file, indent=2)
-    cache_file.write("\n")
-    cache_file.truncate()
+    # The lock serializes the read-modify-write of processes updating different identifiers.
+    with _file_lock(_lock_path(os.path.abspath(cache_file_name))):
+        new_versions_dict = gamla.pipe(
+            _read_versions(cache_file_name),
+            gamla.add_key_value(identifier, hash_dict),
+            dict.items,
+            sorted,
+            dict,
+        )
+        # Write a temporary file and rename it over the versions file, so readers never see a partial file.
+        temp_file_name = f"{cache_file_name}.{os.getpid()}.tmp"
+        with open(temp_file_name, "w") as temp_file:
+            json.dump(new_versions_dict, temp_file, indent=2)
+            temp_file.write("\n")
+            temp_file.flush()
+            os.fsync(temp_file.fileno())
+        os.replace(temp_file_name, cache_file_name)
+        _versions_index[cache_file_name] = (
+            _file_signature(cache_file_name),
+            new_versions_dict,
+        )
 
 
 def _time_since_last_updated(
@@ -85,55 +175,112 @@ def auto_updating_cache(
     should_update: Callable[[Optional[datetime.timedelta]], bool],
     function_to_identifier: Callable,
     custom_spec: Dict[str, Callable],
+    stale_while_revalidate: bool = False,
+    on_refresh_duration: Optional[Callable[[float], None]] = None,
 ):
+    """With `stale_while_revalidate`, when `should_update` an identifier that has a previous result, its `result_hash` is returned
+    immediately and `factory` runs in the background, with a sync `factory` and the upload in a thread. Background refreshes of
+    all caches are limited to `AUTO_UPDATING_CACHE_MAX_BACKGROUND_REFRESHES` (default 2) at a time.
+
+    `on_refresh_duration` is called with the duration in seconds of every refresh (`factory` and upload).
+    """
     cache_file = _create_cache_file(cache_file_path)
     filename = os.path.join(
         os.path.dirname(cache_file),
         custom_spec.get("filename", lambda _: "cache_file")(),
     )
 
-    async def inner(*args, **kwargs):
-        identifier = function_to_identifier(*args, **kwargs)
-        return await gamla.pipe(
-            cache_file,
-            file_store.open_file("r"),
-            json.load,
+    refreshes: Dict[str, asyncio.Future] = {}
+
+    def save(identifier: str, result) -> str:
+        return gamla.pipe(
+            result,
+            file_store.save_to_bucket_return_hash(save_local, bucket_name),
             gamla.side_effect(
                 gamla.compose_left(
-                    _time_since_last_updated(identifier),
-                    _total_hours_since_update,
-                    lambda hours_since_last_update: f"Loading cache for [{identifier}]. Label [{custom_spec.get('label')()}]. Source file [{filename}]. Last updated {hours_since_last_update} hours ago.",
-                    logging.info,
-                ),
-            ),
-            gamla.ternary(
-                gamla.compose_left(_time_since_last_updated(identifier), should_update),
-                gamla.compose_left(
-                    gamla.just(gamla.compose_left(factory, gamla.to_awaitable)),
-                    gamla.apply_async(*args),
-                    file_store.save_to_bucket_return_hash(save_local, bucket_name),
-                    gamla.side_effect(
-                        gamla.compose_left(
-                            gamla.apply_spec(
-                                gamla.merge(
-                                    {
-                                        _RESULT_HASH_KEY: gamla.identity,
-                                        _LAST_RUN_TIMESTAMP: gamla.just(
-                                            datetime.datetime.now().isoformat(),
-                                        ),
-                                    },
-                                    custom_spec,
+                    gamla.apply_spec(
+                        gamla.merge(
+                            {
+                                _RESULT_HASH_KEY: gamla.identity,
+                                _LAST_RUN_TIMESTAMP: gamla.just(
+                                    datetime.datetime.now().isoformat(),
                                 ),
-                            ),
-                            _write_to_cache_file(cache_file, identifier),
+                            },
+                            custom_spec,
                         ),
                     ),
-                    gamla.log_text(f"Finished updating cache for [{identifier}]."),
+                    _write_to_cache_file(cache_file, identifier),
                 ),
-                gamla.get_in([identifier, _RESULT_HASH_KEY]),
             ),
         )
 
+    async def refresh(identifier: str, args, background: bool):
+        # Only one process on the host refreshes an identifier, the others wait and then use its result.
+        async with _async_file_lock(refresh_lock_path(cache_file, identifier)):
+            versions = _read_versions(cache_file)
+            if not should_update(_time_since_last_updated(identifier)(versions)):
+                logging.info(
+                    f"Cache for [{identifier}] was updated by another process.",
+                )
+                return gamla.get_in([identifier, _RESULT_HASH_KEY])(versions)
+            start = time.perf_counter()
+            if background:
+                # Served stale meanwhile, so keep blocking work (a sync `factory`, the upload) off the event loop.
+                result = await gamla.to_awaitable(
+                    await asyncio.to_thread(factory, *args),
+                )
+                result_hash = await asyncio.to_thread(save, identifier, result)
+            else:
+                result_hash = save(
+                    identifier,
+                    await gamla.to_awaitable(factory(*args)),
+                )
+            duration = time.perf_counter() - start
+            logging.info(
+                f"Finished updating cache for [{identifier}] in {duration:.1f} seconds.",
+            )
+            if on_refresh_duration is not None:
+                on_refresh_duration(duration)
+            return result_hash
+
+    async def refresh_in_background(identifier: str, args):
+        async with _background_refresh_limit():
+            return await refresh(identifier, args, True)
+
+    def on_refreshed(identifier: str, future: asyncio.Future):
+        del refreshes[identifier]
+        if not future.cancelled() and future.exception() is not None:
+            logging.error(
+                f"Could not update cache for [{identifier}]: {future.exception()}",
+            )
+
+    async def inner(*args, **kwargs):
+        identifier = function_to_identifier(*args, **kwargs)
+        versions = _read_versions(cache_file)
+        time_since_last_update = _time_since_last_updated(identifier)(versions)
+        logging.info(
+            f"Loading cache for [{identifier}]. Label [{custom_spec.get('label')()}]. Source file [{filename}]. Last updated {_total_hours_since_update(time_since_last_update)} hours ago.",
+        )
+        if not should_update(time_since_last_update):
+            return gamla.get_in([identifier, _RESULT_HASH_KEY])(versions)
+        previous_hash = gamla.get_in_or_none([identifier, _RESULT_HASH_KEY])(versions)
+        background = stale_while_revalidate and previous_hash is not None
+        if identifier not in refreshes:
+            refreshes[identifier] = asyncio.ensure_future(
+                (
+                    refresh_in_background(identifier, args)
+                    if background
+                    else refresh(identifier, args, False)
+                ),
+            )
+            refreshes[identifier].add_done_callback(
+                functools.partial(on_refreshed, identifier),
+            )
+        if background:
+            return previous_hash
+        # Shield so a cancelled caller does not cancel the refresh shared with other callers.
+        return await asyncio.shield(refreshes[identifier])
+
     return inner
 
 
@@ -0,0 +1,199 @@
+import asyncio
+import datetime
+import fcntl
+import json
+import os
+import time
+
+import gamla
+import pytest
+
+from cloud_utils.cache import file_store, utils
+
+
+@pytest.fixture
+def cache_file(tmp_path, monkeypatch):
+    monkeypatch.setattr(
+        file_store,
+        "save_to_bucket_return_hash",
+        lambda save_local, bucket_name: gamla.compute_stable_json_hash,
+    )
+    return str(tmp_path / "versions.json")
+
+
+def _make_cache(cache_file: str, factory, max_age: datetime.timedelta, **kwargs):
+    return utils.auto_updating_cache(
+        factory,
+        cache_file,
+        False,
+        "bucket",
+        lambda time_since: time_since is None or time_since > max_age,
+        lambda x: f"identifier_{x}",
+        {"label": lambda *_: "label", "filename": lambda *_: "file"},
+        **kwargs,
+    )
+
+
+async def test_auto_updating_cache_reuses_fresh_result(cache_file):
+    calls = []
+
+    def factory(x):
+        calls.append(x)
+        return {"x": x}
+
+    cached = _make_cache(cache_file, factory, datetime.timedelta(hours=1))
+
+    result_hash = await cached(1)
+    assert await cached(1) == result_hash
+    assert calls == [1]
+    with open(cache_file) as f:
+        assert json.load(f)["identifier_1"]["result_hash"] == result_hash
+
+
+async def test_auto_updating_cache_rereads_changed_versions_file(cache_file):
+    cached = _make_cache(cache_file, lambda x: {"x": x}, datetime.timedelta(hours=1))
+    await cached(2)
+    await cached(1)
+    with open(cache_file) as f:
+        versions = json.load(f)
+    assert list(versions) == ["identifier_1", "identifier_2"]
+
+    versions["identifier_1"]["result_hash"] = "edited"
+    with open(cache_file, "w") as f:
+        json.dump(versions, f)
+    os.utime(cache_file, ns=(0, 0))
+
+    assert await cached(1) == "edited"
+    assert not [
+        name
+        for name in os.listdir(os.path.dirname(cache_file))
+        if name.endswith(".tmp")
+    ]
+
+
+async def test_auto_updating_cache_refreshes_once_for_concurrent_calls(cache_file):
+    calls = []
+
+    async def factory(x):
+        calls.append(x)
+        await asyncio.sleep(0.01)
+        return {"x": x}
+
+    cached = _make_cache(cache_file, factory, datetime.timedelta(hours=1))
+
+    results = await asyncio.gather(*(cached(1) for _ in range(5)))
+
+    assert len(set(results)) == 1
+    assert calls == [1]
+
+
+async def test_auto_updating_cache_uses_refresh_of_other_process(cache_file):
+    calls = []
+
+    def factory(x):
+        calls.append(x)
+        return {"x": x}
+
+    cached = _make_cache(cache_file, factory, datetime.timedelta(hours=1))
+    # Another process holds the identifier's lock while refreshing it.
+    with open(utils.refresh_lock_path(cache_file, "identifier_1"), "ab") as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        waiting = asyncio.create_task(cached(1))
+        await asyncio.sleep(0.05)
+        with open(cache_file, "w") as f:
+            json.dump(
+                {
+                    "identifier_1": {
+                        "result_hash": "other",
+                        "last_run_timestamp": datetime.datetime.now().isoformat(),
+                    },
+                },
+                f,
+            )
+        fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    assert await waiting == "other"
+    assert calls == []
+
+
+async def test_auto_updating_cache_stale_while_revalidate(cache_file):
+    refreshed = asyncio.Event()
+    durations = []
+
+    async def factory(x):
+        if durations:
+            await refreshed.wait()
+        return {"x": x, "run": len(durations)}
+
+    cached = _make_cache(
+        cache_file,
+        factory,
+        datetime.timedelta(0),
+        stale_while_revalidate=True,
+        on_refresh_duration=durations.append,
+    )
+
+    first_hash = await cached(1)
+    assert len(durations) == 1
+    assert await cached(1) == first_hash
+    refreshed.set()
+    await asyncio.sleep(0.05)
+
+    assert len(durations) == 2
+    with open(cache_file) as f:
+        assert json.load(f)["identifier_1"]["result_hash"] != first_hash
+
+
+def test_auto_updating_cache_background_refreshes_in_several_event_loops(
+    cache_file,
+):
+    durations = []
+
+    async def factory(x):
+        await asyncio.sleep(0.01)
+        return {"x": x, "run": len(durations)}
+
+    async def refresh_all_in_background(run: int):
+        cached = _make_cache(
+            f"{cache_file}.{run}",
+            factory,
+            datetime.timedelta(0),
+            stale_while_revalidate=True,
+            on_refresh_duration=durations.append,
+        )
+        for x in range(3):
+            await cached(x)
+        # More stale identifiers than background refreshes are allowed at a time, so some wait.
+        for x in range(3):
+            await cached(x)
+        await asyncio.sleep(0.2)
+
+    asyncio.run(refresh_all_in_background(1))
+    asyncio.run(refresh_all_in_background(2))
+
+    assert len(durations) == 12
+
+
+async def test_auto_updating_cache_background_refresh_does_not_block(cache_file):
+    durations = []
+
+    def factory(x):
+        if durations:
+            time.sleep(0.5)
+        return {"x": x, "run": len(durations)}
+
+    cached = _make_cache(
+        cache_file,
+        factory,
+        datetime.timedelta(0),
+        stale_while_revalidate=True,
+        on_refresh_duration=durations.append,
+    )
+    first_hash = await cached(1)
+
+    assert await cached(1) == first_hash
+    start = time.perf_counter()
+    await asyncio.sleep(0.01)
+    assert time.perf_counter() - start < 0.25
+    while len(durations) < 2:
+        await asyncio.sleep(0.05)